@@ -1,10 +1,14 @@
 """
 Главный файл приложения - точка входа
 """
+import asyncio
+import atexit
 import logging
+import logging.handlers
+import queue
 import colorlog
-from src.config import Config
-from src.kaspi.api_client import KaspiAPIClient
+from src.config import CONFIG
+from src.kaspi.api_client import KaspiAPIClient, create_http_client
 from src.kaspi.order_service import OrderService
 from src.database.models import Database
 from src.bot.telegram_bot import TelegramBot
@@ -25,10 +29,20 @@ def setup_logging():
         }
     ))
     
-    logging.basicConfig(
-        level=logging.INFO,
-        handlers=[handler]
-    )
+    # Запись в консоль выполняется в отдельном потоке QueueListener,
+    # а логгеры в async коде только кладут записи в очередь и не блокируют event loop
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    level = logging.getLevelName(CONFIG.LOG_LEVEL)
+    if not isinstance(level, int):
+        level = logging.INFO
+    
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
     
     # Уменьшаем уровень логирования для сторонних библиотек
     logging.getLogger('httpx').setLevel(logging.WARNING)
@@ -36,8 +50,20 @@ def setup_logging():
     logging.getLogger('apscheduler').setLevel(logging.WARNING)
     
     # Убираем детальные логи из order_service (оставляем только важное)
-    logging.getLogger('src.kaspi.order_service').setLevel(logging.INFO)
-    logging.getLogger('src.kaspi.api_client').setLevel(logging.INFO)
+    logging.getLogger('src.kaspi.order_service').setLevel(max(level, logging.INFO))
+    logging.getLogger('src.kaspi.api_client').setLevel(max(level, logging.INFO))
+
+
+def setup_event_loop():
+    """Использовать uvloop как event loop, если он установлен (на Windows его нет)"""
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    
+    # run_polling создает цикл через текущую политику, поэтому бот будет работать на uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
 
 
 def main():
@@ -46,19 +72,24 @@ def main():
     setup_logging()
     logger = logging.getLogger(__name__)
     
+    if setup_event_loop():
+        logger.info("✓ Используется uvloop")
+    
     try:
         # Валидируем конфигурацию
-        Config.validate()
+        CONFIG.validate()
         logger.info("✓ Конфигурация загружена успешно")
         
         # Инициализируем базу данных
-        database = Database(Config.DATABASE_URL)
+        database = Database(CONFIG.DATABASE_URL)
         logger.info("✓ База данных инициализирована")
         
         # Инициализируем Kaspi API клиент
+        # Один HTTP клиент на всё время работы бота (закрывается при остановке бота)
         kaspi_client = KaspiAPIClient(
-            api_token=Config.KASPI_API_TOKEN,
-            base_url=Config.KASPI_API_URL
+            api_token=CONFIG.KASPI_API_TOKEN,
+            base_url=CONFIG.KASPI_API_URL,
+            http_client=create_http_client()
         )
         logger.info("✓ Kaspi API клиент создан")
         
@@ -68,16 +99,16 @@ def main():
         
         # Инициализируем Telegram бота
         bot = TelegramBot(
-            token=Config.TELEGRAM_BOT_TOKEN,
-            chat_id=Config.TELEGRAM_CHAT_ID,
+            token=CONFIG.TELEGRAM_BOT_TOKEN,
+            chat_id=CONFIG.TELEGRAM_CHAT_ID,
             order_service=order_service
         )
         bot.setup()
         logger.info("✓ Telegram бот настроен")
         
         # Добавляем задачу периодической проверки заказов
-        bot.add_job_check_orders(Config.POLL_INTERVAL_MINUTES)
-        logger.info(f"✓ Настроена проверка заказов каждые {Config.POLL_INTERVAL_MINUTES} минут")
+        bot.add_job_check_orders(CONFIG.POLL_INTERVAL_MINUTES, CONFIG.POLL_INTERVAL_MAX_MINUTES)
+        logger.info("✓ Настроена проверка заказов каждые %s минут", CONFIG.POLL_INTERVAL_MINUTES)
         
         # Запускаем бота
         logger.info("="*60)
@@ -86,11 +117,11 @@ def main():
         bot.run()
         
     except ValueError as e:
-        logger.error(f"❌ Ошибка конфигурации: {e}")
+        logger.error("❌ Ошибка конфигурации: %s", e)
         logger.error("Проверьте файл .env и убедитесь, что все переменные заполнены")
         return 1
     except Exception as e:
-        logger.error(f"❌ Критическая ошибка: {e}", exc_info=True)
+        logger.error("❌ Критическая ошибка: %s", e, exc_info=True)
         return 1
 
 
@@ -1,21 +1,370 @@
 """
 Telegram бот для уведомлений о заказах
 """
+import asyncio
+import functools
 import logging
+import random
+import sys
+import time
+import weakref
+from collections import OrderedDict
 import httpx
 import io
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
+    AIORateLimiter,
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes
 )
-from typing import Dict
-from datetime import datetime
+from typing import Awaitable, Dict, Optional
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from src.kaspi.order_service import FINISHED_STATUSES
+from src.log_utils import ErrorOnceLogger
 
 logger = logging.getLogger(__name__)
 
+# Максимум одновременных запросов к Telegram при рассылке уведомлений
+# (лимит Telegram - около 30 сообщений в секунду на бота)
+NOTIFICATION_CONCURRENCY = 25
+
+# Максимум одновременно обрабатываемых обновлений (команд и нажатий кнопок)
+MAX_CONCURRENT_UPDATES = 32
+
+# Сколько секунд ждать свободное соединение к Telegram при всплеске отправок
+TELEGRAM_POOL_TIMEOUT = 10.0
+
+# Сколько раз повторять запрос к Telegram после ответа 429 (RetryAfter)
+SEND_MAX_RETRIES = 3
+
+# Первая проверка заказов через столько секунд после запуска
+FIRST_CHECK_DELAY = 10
+
+# Случайный разброс паузы между проверками заказов (доля интервала),
+# чтобы несколько экземпляров бота не обращались к Kaspi одновременно
+POLL_JITTER = 0.05
+
+# ID админов с особыми полномочиями
+ADMIN_IDS = frozenset((554076618, 773205112))
+
+# Статусы заказов, о которых отправляются уведомления
+ACTIVE_STATUSES = frozenset((
+    'APPROVED_BY_BANK',      # Новый заказ, ждет принятия
+    'ACCEPTED_BY_MERCHANT',  # Принят продавцом
+    'ASSEMBLE',              # Передача в доставку
+    'PICKUP'                 # Готов к выдаче
+))
+
+# Сколько секунд действует запрос подтверждения (очистка БД, накладная)
+CONFIRMATION_TTL = 300
+
+# Максимум одновременно ожидающих подтверждений
+MAX_PENDING_CONFIRMATIONS = 1024
+
+# Сколько готовых блоков заказов для /active держать в памяти
+ORDER_BLOCK_CACHE_SIZE = 512
+
+# Поля заказа, которые выводятся в блоке /active (кроме товаров), см. _active_order_key
+ACTIVE_ORDER_BLOCK_FIELDS = (
+    'code', 'creation_date', 'is_express', 'total_price', 'customer_name',
+    'warehouse_name', 'delivery_type_text', 'delivery_address', 'planned_delivery_date',
+    'waybill_url', 'is_kaspi_delivery'
+)
+
+# Максимальная длина текста сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Разделитель заказов в объединенном уведомлении
+BATCH_SEPARATOR = "\n\n➖➖➖➖➖➖➖➖\n\n"
+
+# Окно объединения запросов PDF накладных из БД (секунды)
+WAYBILL_BATCH_WINDOW = 0.05
+
+# Сколько отформатированных сумм держать в памяти
+PRICE_CACHE_SIZE = 8192
+
+# Сколько готовых клавиатур уведомлений держать в памяти
+KEYBOARD_CACHE_SIZE = 512
+
+# Сколько сокращенных названий и кодов товаров держать в памяти
+ITEM_TEXT_CACHE_SIZE = 4096
+
+# Сколько отформатированных дат держать в памяти
+DATE_CACHE_SIZE = 2048
+
+# Формат даты в сообщении о запуске (даты заказов форматируются в _format_date/_format_datetime)
+DATETIME_SECONDS_FORMAT = '%d.%m.%Y %H:%M:%S'
+
+# Часовой пояс магазина - объект зоны создается один раз
+try:
+    LOCAL_TZ = ZoneInfo("Asia/Almaty")
+except ZoneInfoNotFoundError:
+    # Нет базы часовых поясов (например, в минимальном контейнере) - Алматы это UTC+5
+    LOCAL_TZ = timezone(timedelta(hours=5), "Asia/Almaty")
+
+# Шаблоны сообщений - разбираются один раз при импорте модуля
+EXPRESS_HEADER = "⚡️ <b>EXPRESS ДОСТАВКА</b> ⚡️\n"
+
+ORDER_MESSAGE_TEMPLATE = (
+    "{express}"
+    "🆕 <b>Новый заказ #{code}</b>\n"
+    "{created}\n"
+    "📦 <b>Что отправить:</b>\n"
+    "<code>{items_block}</code>\n"
+    "\n<b>Итого:</b> {total_price_text}\n\n"
+    "📍 <b>Склад отправки:</b> {warehouse_name}\n"
+    "{warehouse_address}\n\n"
+    "👤 <b>Клиент:</b>\n"
+    "{customer_name}\n\n"
+    "🚚 <b>Доставка:</b>\n"
+    "{delivery_type_text}\n"
+    "📍 {delivery_address}"
+    "{deadline}"
+)
+
+EMPTY_ACTIVE_ORDERS_MESSAGE = "📋 Нет активных заказов"
+ACTIVE_ORDERS_HEADER = "📋 <b>Активные заказы (%d):</b>"
+
+ACTIVE_ORDER_TEMPLATE = (
+    "Сумма: {total_price_text}\n"
+    "Клиент: {customer_name}\n"
+    "Склад: {warehouse_name}\n"
+    "Доставка: {delivery_type_text}\n"
+    "Адрес: {delivery_address}"
+)
+
+STARTUP_TEMPLATE = (
+    "🤖 <b>Бот запущен!</b>\n\n"
+    "Мониторинг заказов Kaspi активирован.\n"
+    "Проверка новых заказов каждые {interval} минут.\n\n"
+    "Дата и время запуска: {started}"
+)
+
+WAYBILL_EXISTS_TEMPLATE = (
+    "ℹ️ <b>Накладная для заказа #{code} уже сформирована</b>\n\n"
+    "Статус: {status}\n\n"
+    "{tail}"
+)
+
+WAYBILL_SUCCESS_TEMPLATE = (
+    "✅ <b>Накладная для заказа #{code} сформирована!</b>\n\n"
+    "Количество мест: {spaces}\n"
+    "Статус изменен на: ASSEMBLE (Передача)\n\n"
+    "{tail}"
+)
+
+WAYBILL_READY_TAIL = "Накладная доступна:"
+WAYBILL_PENDING_TAIL = "Накладная будет доступна в личном кабинете Kaspi."
+WAYBILL_PENDING_SOON_TAIL = "Накладная будет доступна в личном кабинете Kaspi через несколько минут."
+
+
+@functools.lru_cache(maxsize=PRICE_CACHE_SIZE)
+def _format_kzt(amount: float) -> str:
+    """
+    Сумма в тенге с разделителем тысяч: 12500 -> "12,500 ₸"
+    
+    Цены в заказах часто повторяются, поэтому готовые строки кэшируются
+    """
+    return f"{amount:,.0f} ₸"
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _format_date(value: datetime) -> str:
+    """Дата в формате ДД.ММ.ГГГГ (без разбора формата strftime на каждый вызов)"""
+    return f"{value.day:02d}.{value.month:02d}.{value.year:04d}"
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _format_datetime(value: datetime) -> str:
+    """Дата и время в формате ДД.ММ.ГГГГ ЧЧ:ММ"""
+    return f"{value.day:02d}.{value.month:02d}.{value.year:04d} {value.hour:02d}:{value.minute:02d}"
+
+
+@functools.lru_cache(maxsize=ITEM_TEXT_CACHE_SIZE)
+def _short_item_name(name: str) -> str:
+    """Название товара для /active: если слишком длинное, берем только первые 30 символов"""
+    return name if len(name) <= 30 else name[:30] + "..."
+
+
+@functools.lru_cache(maxsize=ITEM_TEXT_CACHE_SIZE)
+def _short_item_code(code: str) -> str:
+    """Код товара для /active: если слишком длинный, берем только последние 15 символов"""
+    return code if len(code) <= 15 else "..." + code[-15:]
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def _waybill_keyboard(waybill_url: str, order_code: str) -> InlineKeyboardMarkup:
+    """Клавиатура со ссылкой на накладную и кнопкой получения PDF"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("📄 Скачать онлайн", url=waybill_url),
+        InlineKeyboardButton("📥 Получить PDF", callback_data=f"download_waybill:{order_code}")
+    ]])
+
+
+def _active_order_key(order: Dict) -> tuple:
+    """
+    Ключ блока заказа для /active - все выводимые в блоке данные
+    
+    Args:
+        order: Словарь с данными о заказе
+    
+    Returns:
+        Кортеж значений полей и показываемых товаров
+    """
+    get = order.get
+    items = get('items') or ()
+    return (
+        tuple(get(field) for field in ACTIVE_ORDER_BLOCK_FIELDS),
+        len(items),
+        tuple(
+            (item['name'], item.get('description'), item['quantity'], item.get('code_short'))
+            for item in items[:2]
+        )
+    )
+
+
+def _accept_row(order_id: str, order_code: str, waybill_url: Optional[str]) -> list:
+    """Кнопка "Принять заказ" - для новых заказов (APPROVED_BY_BANK)"""
+    return [
+        InlineKeyboardButton(
+            "✅ Принять заказ", 
+            callback_data=f"accept_order:{order_id}:{order_code}"
+        )
+    ]
+
+
+def _create_waybill_row(order_id: str, order_code: str, waybill_url: Optional[str]) -> Optional[list]:
+    """Кнопка "Сформировать накладную" - для принятых заказов, у которых еще нет накладной"""
+    if waybill_url:
+        return None
+    return [
+        InlineKeyboardButton(
+            "📋 Сформировать накладную", 
+            callback_data=f"waybill:{order_id}:{order_code}"
+        )
+    ]
+
+
+# Кнопки уведомления по статусу заказа (кнопки накладной добавляются отдельно)
+STATUS_KEYBOARD_ROWS = {
+    'APPROVED_BY_BANK': (_accept_row,),
+    'ACCEPTED_BY_MERCHANT': (_create_waybill_row,),
+    'PICKUP': (_create_waybill_row,),
+}
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def _order_keyboard(order_id: str, order_code: str, status: str,
+                    waybill_url: str, is_kaspi_delivery: bool) -> Optional[InlineKeyboardMarkup]:
+    """
+    Клавиатура уведомления о заказе
+    
+    Разметка неизменяема, поэтому одна и та же клавиатура переиспользуется
+    для повторных уведомлений с теми же данными
+    
+    Returns:
+        Клавиатура или None если кнопок нет
+    """
+    keyboard = []
+    
+    # Кнопки, зависящие от статуса заказа
+    for build_row in STATUS_KEYBOARD_ROWS.get(status, ()):
+        row = build_row(order_id, order_code, waybill_url)
+        if row:
+            keyboard.append(row)
+    
+    # Кнопки для скачивания накладной если это Kaspi Доставка и накладная уже есть
+    if is_kaspi_delivery and waybill_url:
+        keyboard.extend(_waybill_keyboard(waybill_url, order_code).inline_keyboard)
+    
+    return InlineKeyboardMarkup(keyboard) if keyboard else None
+
+
+def _keyboard_for_order(order: Dict) -> Optional[InlineKeyboardMarkup]:
+    """Клавиатура уведомления для словаря заказа (из кэша)"""
+    return _order_keyboard(
+        order['id'],
+        order['code'],
+        order.get('status'),
+        order.get('waybill_url'),
+        bool(order.get('is_kaspi_delivery'))
+    )
+
+
+# Тексты /help - собираются один раз при импорте модуля
+HELP_TEXT = (
+    "📖 <b>Помощь по боту</b>\n\n"
+    "Бот автоматически отправляет уведомления о новых заказах каждые 10 минут.\n\n"
+    "<b>Команды:</b>\n"
+    "/active - Показать все активные заказы (не переданные в доставку)\n"
+    "/waybills - Сформировать накладные для активных заказов\n"
+    "/help - Показать это сообщение\n\n"
+    "<b>Информация в уведомлениях:</b>\n"
+    "• Номер заказа\n"
+    "• Дата и время создания заказа\n"
+    "• Список товаров с описанием и сумма\n"
+    "• Склад отправки\n"
+    "• Имя клиента\n"
+    "• Тип доставки (с иконками)\n"
+    "• Адрес доставки\n"
+    "• Срок доставки\n"
+    "• Накладная (для Kaspi Доставки)\n\n"
+    "<b>Кнопки:</b>\n"
+    "✅ Принять заказ - принять новый заказ в обработку\n"
+    "📋 Сформировать накладную - создать накладную для передачи в Kaspi Доставку\n"
+)
+
+HELP_TEXT_ADMIN = HELP_TEXT + (
+    "\n\n<b>⚙️ Команды администратора:</b>\n"
+    "/clear_db - Очистить базу данных"
+)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обработчик обновлений: разные чаты обрабатываются параллельно,
+    а обновления одного чата - строго по очереди
+    
+    Семафор базового класса берется до вызова do_process_update, то есть до ожидания
+    блокировки чата - серия нажатий в одном чате заняла бы все места и остановила
+    остальные чаты. Поэтому базовому классу лимит не передается, а место занимается
+    в do_process_update, когда очередь чата уже дошла до обновления
+    """
+    
+    __slots__ = ("_chat_locks", "_update_slots")
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(sys.maxsize)
+        # Блокировка на каждый чат; удаляется сама, когда в чате нет обновлений в работе
+        self._chat_locks = weakref.WeakValueDictionary()
+        # Места для одновременной обработки - только обновлениям, дождавшимся своего чата
+        self._update_slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        """Обработать обновление, сохраняя порядок внутри чата"""
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._update_slots:
+                await coroutine
+            return
+        
+        lock = self._chat_locks.get(chat.id)
+        if lock is None:
+            lock = self._chat_locks[chat.id] = asyncio.Lock()
+        
+        async with lock, self._update_slots:
+            await coroutine
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
 
 class TelegramBot:
     """Класс для управления Telegram ботом"""
@@ -27,10 +376,38 @@ class TelegramBot:
         self.application = None
         
         # ID админов с особыми полномочиями
-        self.admin_ids = [554076618, 773205112]
+        self.admin_ids = ADMIN_IDS
         
         # Состояния для подтверждений
-        self.pending_confirmations = {}  # {user_id: {'action': 'clear_db', 'data': {...}}}
+        # {user_id: (срок действия, {'action': 'clear_db', ...})}, не больше MAX_PENDING_CONFIRMATIONS
+        self.pending_confirmations = OrderedDict()
+        
+        # Периодическая проверка заказов: фоновая задача и адаптивный интервал
+        self._poll_task = None
+        self._base_interval = 0
+        self._max_interval = 0
+        self._empty_streak = 0  # Сколько проверок подряд не нашли новых заказов
+        
+        # Ожидающие запросы PDF накладных из БД: {код заказа: [future, ...]}
+        self._pdf_batch = {}
+        self._pdf_batch_task = None
+        
+        # Готовые блоки заказов для /active (LRU по всем выводимым полям, см. _active_order_key)
+        self._active_order_blocks = OrderedDict()
+        
+        # Обработчики inline кнопок по префиксу callback_data
+        self._callback_handlers = {
+            'download_waybill': self._cb_download_waybill,
+            'accept_order': self._cb_accept_order,
+            'waybill': self._cb_waybill,
+            'confirm_waybill': self._cb_confirm_waybill,
+            'confirm_clear_db': self._cb_confirm_clear_db,
+            'cancel_action': self._cb_cancel,
+            'cancel_clear_db': self._cb_cancel,
+        }
+        
+        # Трассировка стека ошибок периодической проверки - только при первом появлении
+        self._errors = ErrorOnceLogger(logger)
     
     def format_order_message(self, order: Dict) -> str:
         """
@@ -42,66 +419,39 @@ class TelegramBot:
         Returns:
             Отформатированный текст сообщения
         """
-        message_parts = []
-        
-        # Если экспресс-доставка, выделяем это в начале
-        if order.get('is_express'):
-            message_parts.append("⚡️ <b>EXPRESS ДОСТАВКА</b> ⚡️")
-        
-        message_parts.append(f"🆕 <b>Новый заказ #{order['code']}</b>")
-        
-        # Добавляем дату создания заказа
-        if order.get('creation_date'):
-            creation_date = order['creation_date'].strftime('%d.%m.%Y %H:%M')
-            message_parts.append(f"📅 <b>Создан:</b> {creation_date}\n")
-        else:
-            message_parts.append("")
-        
-        message_parts.append(f"📦 <b>Что отправить:</b>")
-        
-        # Добавляем товары - всё в одном блоке <code> для удобного копирования
-        items_text = []
+        # Товары - всё в одном блоке <code> для удобного копирования
+        # (пишем в буфер, каждая строка - с переводом строки перед ней)
+        items_buf = io.StringIO()
+        write = items_buf.write
         for item in order['items']:
+            name, description = item['name'], item.get('description')
+            quantity, price, total_price = item['quantity'], item['price'], item['total_price']
+            
             # Формируем строку: Название | Код: XXX
-            item_line = item['name']
-            if item.get('description'):
-                item_line += f" | Код: {item['description']}"
-            items_text.append(item_line)
+            write(f"\n{name} | Код: {description}" if description else f"\n{name}")
             
             # Количество и цена
-            price_line = f"{item['quantity']} шт × {item['price']:,.0f} ₸ = {item['total_price']:,.0f} ₸"
-            items_text.append(price_line)
+            write(f"\n{quantity} шт × {_format_kzt(price)} = {_format_kzt(total_price)}")
         
-        # Весь список товаров в одном <code> блоке
-        message_parts.append(f"<code>{chr(10).join(items_text)}</code>")
-        
-        message_parts.append(f"\n<b>Итого:</b> {order['total_price']:,.0f} ₸\n")
-        
-        # Информация о складе
-        message_parts.extend([
-            f"📍 <b>Склад отправки:</b> {order['warehouse_name']}",
-            f"{order['warehouse_address']}\n"
-        ])
-        
-        # Информация о клиенте (без номера телефона)
-        message_parts.extend([
-            f"👤 <b>Клиент:</b>",
-            f"{order['customer_name']}\n"
-        ])
-        
-        # Информация о доставке - теперь с иконками и четким указанием типа
-        message_parts.extend([
-            f"🚚 <b>Доставка:</b>",
-            f"{order['delivery_type_text']}",
-            f"📍 {order['delivery_address']}"
-        ])
+        # Дата создания заказа
+        created = ""
+        if order.get('creation_date'):
+            created = f"📅 <b>Создан:</b> {_format_datetime(order['creation_date'])}\n"
         
         # Срок доставки
+        deadline = ""
         if order['planned_delivery_date']:
-            delivery_date = order['planned_delivery_date'].strftime('%d.%m.%Y')
-            message_parts.append(f"⏰ <b>Срок доставки:</b> {delivery_date}")
+            deadline = f"\n⏰ <b>Срок доставки:</b> {_format_date(order['planned_delivery_date'])}"
         
-        return '\n'.join(message_parts)
+        return ORDER_MESSAGE_TEMPLATE.format_map({
+            **order,
+            # Если экспресс-доставка, выделяем это в начале
+            'express': EXPRESS_HEADER if order.get('is_express') else "",
+            'created': created,
+            'items_block': items_buf.getvalue()[1:],
+            'total_price_text': _format_kzt(order['total_price']),
+            'deadline': deadline,
+        })
     
     def format_active_orders_message(self, orders: list) -> str:
         """
@@ -114,79 +464,121 @@ class TelegramBot:
             Отформатированный текст сообщения
         """
         if not orders:
-            return "📋 Нет активных заказов"
+            return EMPTY_ACTIVE_ORDERS_MESSAGE
         
-        message_parts = [f"📋 <b>Активные заказы ({len(orders)}):</b>"]
+        # Сообщение пишется в один буфер, каждый блок заказа - с переводом строки перед ним
+        buf = io.StringIO()
+        buf.write(ACTIVE_ORDERS_HEADER % len(orders))
+        
+        write = buf.write
+        render = self._render_active_order
         
         for order in orders:
-            creation_date = ""
-            if order.get('creation_date'):
-                creation_date = order['creation_date'].strftime('%d.%m.%Y %H:%M')
-            
-            delivery_date = ""
-            if order['planned_delivery_date']:
-                delivery_date = order['planned_delivery_date'].strftime('%d.%m.%Y')
-            
-            # Заголовок заказа с пометкой экспресс если нужно
-            order_header = f"🔹 <b>Заказ #{order['code']}</b> • {creation_date}"
-            if order.get('is_express'):
-                order_header = f"⚡️ {order_header}"
-            message_parts.append(order_header)
-            
-            # Товары - компактный формат
-            if order.get('items'):
-                items_list = []
-                for item in order['items']:
-                    item_name = item['name']
-                    # Если название слишком длинное, берем только первые 30 символов
-                    if len(item_name) > 30:
-                        item_name = item_name[:30] + "..."
-                    
-                    # Добавляем код если есть в description
-                    if item.get('description'):
-                        # Извлекаем только код (последняя часть после последнего |)
-                        parts = item['description'].split('|')
-                        code = parts[-1].strip() if parts else item['description']
-                        # Если код слишком длинный, берем только последние 15 символов
-                        if len(code) > 15:
-                            code = "..." + code[-15:]
-                        item_text = f"{item_name} (Код: {code}, {item['quantity']} шт)"
-                    else:
-                        item_text = f"{item_name} ({item['quantity']} шт)"
-                    
-                    items_list.append(item_text)
-                
-                # Если товаров больше 2, показываем только первые 2 и "+N еще"
-                if len(items_list) > 2:
-                    shown_items = items_list[:2]
-                    remaining = len(items_list) - 2
-                    message_parts.append(f"Товары: {'; '.join(shown_items)} +{remaining} еще")
-                else:
-                    message_parts.append(f"Товары: {'; '.join(items_list)}")
-            
-            # Получаем текстовое описание доставки (без адреса для компактности)
-            delivery_type = order.get('delivery_type_text', 'Не указан')
-            
-            # Остальная информация
-            message_parts.extend([
-                f"Сумма: {order['total_price']:,.0f} ₸",
-                f"Клиент: {order['customer_name']}",
-                f"Склад: {order['warehouse_name']}",
-                f"Доставка: {delivery_type}",
-                f"Адрес: {order['delivery_address']}",
-                f"Срок: {delivery_date}" if delivery_date else ""
-            ])
-            
-            # Добавляем ссылку на накладную если есть
-            if order.get('is_kaspi_delivery') and order.get('waybill_url'):
-                message_parts.append(f"📄 <a href=\"{order['waybill_url']}\">Скачать накладную</a>")
-            
-            message_parts.append("")  # Пустая строка между заказами
+            write("\n")
+            write(render(order))
         
-        # Убираем пустые строки
-        message_parts = [part for part in message_parts if part]
+        return buf.getvalue()
+    
+    def _render_active_order(self, order: Dict) -> str:
+        """
+        Блок одного заказа для /active с кэшированием
+        
+        Готовый блок переиспользуется, пока не изменилось ни одно из выводимых
+        в нем значений (см. _active_order_key)
+        
+        Args:
+            order: Словарь с данными о заказе
         
-        return '\n'.join(message_parts)
+        Returns:
+            Текст блока заказа
+        """
+        key = _active_order_key(order)
+        cache = self._active_order_blocks
+        
+        block = cache.get(key)
+        if block is None:
+            block = self._format_active_order(order)
+            cache[key] = block
+            if len(cache) > ORDER_BLOCK_CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        
+        return block
+    
+    def _format_active_order(self, order: Dict) -> str:
+        """
+        Форматировать блок одного заказа для списка активных заказов
+        
+        Args:
+            order: Словарь с данными о заказе
+        
+        Returns:
+            Текст блока заказа
+        """
+        buf = io.StringIO()
+        write = buf.write
+        get = order.get
+        
+        creation_date = _format_datetime(order['creation_date']) if get('creation_date') else ""
+        
+        # Заголовок заказа с пометкой экспресс если нужно
+        order_header = f"🔹 <b>Заказ #{order['code']}</b> • {creation_date}"
+        if get('is_express'):
+            order_header = f"⚡️ {order_header}"
+        write(order_header)
+        
+        # Товары - компактный формат: показываем только первые 2 и "+N еще"
+        items = get('items')
+        if items:
+            write("\nТовары: ")
+            write('; '.join(self._iter_active_items(items[:2])))
+            more = len(items) - 2
+            if more > 0:
+                write(f" +{more} еще")
+        
+        # Получаем текстовое описание доставки (без адреса для компактности)
+        delivery_type = get('delivery_type_text', 'Не указан')
+        
+        # Остальная информация
+        write("\n")
+        write(ACTIVE_ORDER_TEMPLATE.format_map({
+            **order,
+            'total_price_text': _format_kzt(order['total_price']),
+            'delivery_type_text': delivery_type
+        }))
+        if order['planned_delivery_date']:
+            write(f"\nСрок: {_format_date(order['planned_delivery_date'])}")
+        
+        # Добавляем ссылку на накладную если есть
+        waybill_url = get('waybill_url')
+        if waybill_url and get('is_kaspi_delivery'):
+            write(f"\n📄 <a href=\"{waybill_url}\">Скачать накладную</a>")
+        
+        return buf.getvalue()
+    
+    @staticmethod
+    def _iter_active_items(items: list):
+        """
+        Строки товаров в компактном формате для списка активных заказов
+        
+        Args:
+            items: Товары заказа, которые нужно показать
+        
+        Yields:
+            Текст товара
+        """
+        for item in items:
+            item_name, description, quantity = _short_item_name(item['name']), item.get('description'), item['quantity']
+            
+            # Добавляем код если есть в description (code_short заранее готовит OrderService)
+            if description:
+                code = item.get('code_short')
+                if code is None:
+                    code = description.rpartition('|')[2].strip()
+                yield f"{item_name} (Код: {_short_item_code(code)}, {quantity} шт)"
+            else:
+                yield f"{item_name} ({quantity} шт)"
     
     async def send_waybill_from_db(self, order_code: str, chat_id: str):
         """
@@ -197,10 +589,10 @@ class TelegramBot:
             chat_id: ID чата для отправки
         """
         try:
-            logger.info(f"Отправляю накладную для заказа {order_code} из БД")
+            logger.info("Отправляю накладную для заказа %s из БД", order_code)
             
-            # Получаем PDF из БД
-            pdf_data = self.order_service.db.get_order_waybill_pdf(order_code)
+            # Получаем PDF из БД (одновременные запросы объединяются в один)
+            pdf_data = await self._get_waybill_pdf(order_code)
             
             if not pdf_data:
                 await self.application.bot.send_message(
@@ -213,21 +605,63 @@ class TelegramBot:
             # Отправляем как документ
             await self.application.bot.send_document(
                 chat_id=chat_id,
-                document=io.BytesIO(pdf_data),
+                document=pdf_data,
                 filename=f"Накладная_{order_code}.pdf",
                 caption=f"📄 Накладная для заказа #{order_code}"
             )
             
-            logger.info(f"Накладная для заказа {order_code} успешно отправлена из БД")
+            logger.info("Накладная для заказа %s успешно отправлена из БД", order_code)
             
         except Exception as e:
-            logger.error(f"Ошибка при отправке накладной из БД: {e}")
+            logger.error("Ошибка при отправке накладной из БД: %s", e)
             await self.application.bot.send_message(
                 chat_id=chat_id,
                 text=f"❌ Не удалось отправить накладную для заказа #{order_code}",
                 parse_mode='HTML'
             )
     
+    async def _get_waybill_pdf(self, order_code: str) -> Optional[bytes]:
+        """
+        Получить PDF накладной из БД
+        
+        Запросы, пришедшие в течение WAYBILL_BATCH_WINDOW секунд, выполняются
+        одним SELECT ... WHERE code IN (...) в отдельном потоке
+        
+        Args:
+            order_code: Код заказа
+        
+        Returns:
+            PDF накладной или None если его нет в БД
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pdf_batch.setdefault(order_code, []).append(future)
+        
+        if self._pdf_batch_task is None:
+            self._pdf_batch_task = asyncio.create_task(self._flush_pdf_batch())
+        
+        return await future
+    
+    async def _flush_pdf_batch(self):
+        """Выполнить накопленные запросы PDF накладных одним запросом к БД"""
+        await asyncio.sleep(WAYBILL_BATCH_WINDOW)
+        
+        batch, self._pdf_batch = self._pdf_batch, {}
+        self._pdf_batch_task = None
+        
+        try:
+            pdfs = await asyncio.to_thread(self.order_service.db.get_orders_waybill_pdfs, list(batch))
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        
+        for order_code, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(pdfs.get(order_code))
+    
     async def download_and_send_waybill(self, waybill_url: str, order_code: str, chat_id: str):
         """
         Скачать PDF накладную и отправить её в чат
@@ -238,57 +672,43 @@ class TelegramBot:
             chat_id: ID чата для отправки
         """
         try:
-            logger.info(f"Скачиваю накладную для заказа {order_code} из {waybill_url}")
-            
-            # Используем токен авторизации для скачивания
-            headers = {
-                'X-Auth-Token': self.order_service.kaspi.api_token,
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'application/pdf,*/*',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8'
-            }
-            
-            # Скачиваем PDF
-            async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-                response = await client.get(waybill_url, headers=headers)
-                response.raise_for_status()
-                
-                pdf_content = response.content
-                
-                # Проверяем что это действительно PDF
-                if not pdf_content.startswith(b'%PDF'):
-                    logger.error(f"Полученный файл не является PDF")
-                    await self.application.bot.send_message(
-                        chat_id=chat_id,
-                        text=f"❌ Файл по ссылке не является PDF накладной.\n"
-                             f"Попробуйте скачать по <a href=\"{waybill_url}\">прямой ссылке</a>",
-                        parse_mode='HTML'
-                    )
-                    return
-                
-                # Сохраняем PDF в БД
-                self.order_service.db.update_order_waybill(
-                    order_code=order_code,
-                    waybill_url=waybill_url,
-                    waybill_pdf_data=pdf_content
-                )
-                logger.info(f"PDF накладной для заказа {order_code} сохранен в БД")
-                
-                # Отправляем как документ
-                await self.application.bot.send_document(
+            logger.info("Скачиваю накладную для заказа %s из %s", order_code, waybill_url)
+            
+            # Скачиваем PDF потоком через клиент OrderService (заголовки с токеном уже в нем)
+            pdf_content = await self.order_service.read_waybill_pdf(waybill_url)
+            
+            # Проверяем что это действительно PDF
+            if pdf_content is None:
+                await self.application.bot.send_message(
                     chat_id=chat_id,
-                    document=io.BytesIO(pdf_content),
-                    filename=f"Накладная_{order_code}.pdf",
-                    caption=f"📄 Накладная для заказа #{order_code}"
+                    text=f"❌ Файл по ссылке не является PDF накладной.\n"
+                         f"Попробуйте скачать по <a href=\"{waybill_url}\">прямой ссылке</a>",
+                    parse_mode='HTML'
                 )
-                
-                logger.info(f"Накладная для заказа {order_code} успешно отправлена")
+                return
+            
+            # Сохраняем PDF в БД (в отдельном потоке, чтобы не блокировать event loop)
+            await asyncio.to_thread(
+                self.order_service.db.update_order_waybill,
+                order_code=order_code,
+                waybill_url=waybill_url,
+                waybill_pdf_data=pdf_content
+            )
+            logger.info("PDF накладной для заказа %s сохранен в БД", order_code)
+            
+            # Отправляем как документ - байты передаются напрямую, без промежуточного BytesIO
+            await self.application.bot.send_document(
+                chat_id=chat_id,
+                document=pdf_content,
+                filename=f"Накладная_{order_code}.pdf",
+                caption=f"📄 Накладная для заказа #{order_code}"
+            )
+            
+            logger.info("Накладная для заказа %s успешно отправлена", order_code)
                 
         except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP ошибка при скачивании накладной: {e.response.status_code}")
-            logger.error(f"Ответ сервера: {e.response.text[:500]}")
+            logger.error("HTTP ошибка при скачивании накладной: %s", e.response.status_code)
+            logger.error("Ответ сервера: %s", e.response.text[:500])
             
             await self.application.bot.send_message(
                 chat_id=chat_id,
@@ -297,7 +717,7 @@ class TelegramBot:
                 parse_mode='HTML'
             )
         except Exception as e:
-            logger.error(f"Ошибка при скачивании/отправке накладной: {type(e).__name__}: {e}")
+            logger.error("Ошибка при скачивании/отправке накладной: %s: %s", type(e).__name__, e)
 
             await self.application.bot.send_message(
                 chat_id=chat_id,
@@ -314,37 +734,10 @@ class TelegramBot:
             order: Словарь с данными о заказе
         """
         try:
-            message = self.format_order_message(order)
-            
-            # Создаем кнопки для нового заказа
-            keyboard = []
-            
-            # Кнопка "Принять заказ" только для заказов со статусом APPROVED_BY_BANK
-            if order.get('status') == 'APPROVED_BY_BANK':
-                keyboard.append([
-                    InlineKeyboardButton(
-                        "✅ Принять заказ", 
-                        callback_data=f"accept_order:{order['id']}:{order['code']}"
-                    )
-                ])
-            
-            # Кнопка "Сформировать накладную" для заказов которые приняты
-            if order.get('status') in ['ACCEPTED_BY_MERCHANT', 'PICKUP'] and not order.get('waybill_url'):
-                keyboard.append([
-                    InlineKeyboardButton(
-                        "📋 Сформировать накладную", 
-                        callback_data=f"waybill:{order['id']}:{order['code']}"
-                    )
-                ])
-            
-            # Кнопки для скачивания накладной если это Kaspi Доставка и накладная уже есть
-            if order.get('is_kaspi_delivery') and order.get('waybill_url'):
-                keyboard.append([
-                    InlineKeyboardButton("📄 Скачать онлайн", url=order['waybill_url']),
-                    InlineKeyboardButton("📥 Получить PDF", callback_data=f"download_waybill:{order['code']}")
-                ])
+            # Клавиатура зависит только от статуса, идентификаторов и накладной - берем из кэша
+            reply_markup = _keyboard_for_order(order)
             
-            reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+            message = self.format_order_message(order)
             
             await self.application.bot.send_message(
                 chat_id=self.chat_id,
@@ -353,10 +746,45 @@ class TelegramBot:
                 reply_markup=reply_markup
             )
             
-            logger.info(f"Отправлено уведомление о заказе {order['code']}")
+            logger.info("Отправлено уведомление о заказе %s", order['code'])
             
         except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления о заказе: {e}")
+            logger.error("Ошибка при отправке уведомления о заказе: %s", e)
+    
+    async def send_orders_batch(self, orders: list):
+        """
+        Отправить уведомления о нескольких заказах объединенными сообщениями
+        
+        Заказы упаковываются в сообщения подряд, пока текст не упрется в лимит Telegram.
+        Подходит только для заказов без кнопок - клавиатура у сообщения одна.
+        
+        Args:
+            orders: Список заказов без клавиатуры
+        """
+        chunks = []
+        current = ""
+        
+        for order in orders:
+            text = self.format_order_message(order)
+            if current and len(current) + len(BATCH_SEPARATOR) + len(text) > TELEGRAM_MESSAGE_LIMIT:
+                chunks.append(current)
+                current = text
+            else:
+                current = f"{current}{BATCH_SEPARATOR}{text}" if current else text
+        if current:
+            chunks.append(current)
+        
+        for chunk in chunks:
+            try:
+                await self.application.bot.send_message(
+                    chat_id=self.chat_id,
+                    text=chunk,
+                    parse_mode='HTML'
+                )
+            except Exception as e:
+                logger.error("Ошибка при отправке объединенного уведомления: %s", e)
+        
+        logger.info("Отправлено объединенное уведомление: %d заказов, %d сообщений", len(orders), len(chunks))
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
@@ -370,60 +798,65 @@ class TelegramBot:
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
-        user_id = update.effective_user.id
-        
-        help_text = (
-            "📖 <b>Помощь по боту</b>\n\n"
-            "Бот автоматически отправляет уведомления о новых заказах каждые 10 минут.\n\n"
-            "<b>Команды:</b>\n"
-            "/active - Показать все активные заказы (не переданные в доставку)\n"
-            "/waybills - Сформировать накладные для активных заказов\n"
-            "/help - Показать это сообщение\n\n"
-            "<b>Информация в уведомлениях:</b>\n"
-            "• Номер заказа\n"
-            "• Дата и время создания заказа\n"
-            "• Список товаров с описанием и сумма\n"
-            "• Склад отправки\n"
-            "• Имя клиента\n"
-            "• Тип доставки (с иконками)\n"
-            "• Адрес доставки\n"
-            "• Срок доставки\n"
-            "• Накладная (для Kaspi Доставки)\n\n"
-            "<b>Кнопки:</b>\n"
-            "✅ Принять заказ - принять новый заказ в обработку\n"
-            "📋 Сформировать накладную - создать накладную для передачи в Kaspi Доставку\n"
-        )
-        
-        # Добавляем админские команды если это админ
-        if user_id in self.admin_ids:
-            help_text += (
-                "\n\n<b>⚙️ Команды администратора:</b>\n"
-                "/clear_db - Очистить базу данных"
-            )
+        # Админам показываем справку с командами администратора
+        help_text = HELP_TEXT_ADMIN if update.effective_user.id in self.admin_ids else HELP_TEXT
         
         await update.message.reply_text(help_text, parse_mode='HTML')
     
     async def active_orders_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /active - показать активные заказы"""
         try:
-            orders = await self.order_service.get_active_orders()
-            
-            # Добавляем delivery_type_text для каждого заказа
-            for order in orders:
-                if 'delivery_type_text' not in order:
-                    order['delivery_type_text'] = self.order_service._get_delivery_type_text(
-                        order.get('delivery_mode', ''),
-                        order.get('is_kaspi_delivery', False)
-                    )
-            
-            message = self.format_active_orders_message(orders)
+            # Блоки заказов берутся из кэша _render_active_order, заново форматируются только изменившиеся
+            message = self.format_active_orders_message(await self.order_service.get_active_orders())
             await update.message.reply_text(message, parse_mode='HTML')
         except Exception as e:
-            logger.error(f"Ошибка при получении активных заказов: {e}")
+            logger.error("Ошибка при получении активных заказов: %s", e)
             await update.message.reply_text(
                 "❌ Произошла ошибка при получении списка заказов"
             )
     
+    def _set_confirmation(self, user_id: int, confirmation: Dict):
+        """
+        Сохранить ожидающее подтверждение пользователя на CONFIRMATION_TTL секунд
+        
+        Args:
+            user_id: ID пользователя
+            confirmation: Данные подтверждения ('action' и параметры)
+        """
+        pending = self.pending_confirmations
+        now = time.monotonic()
+        
+        pending[user_id] = (now + CONFIRMATION_TTL, confirmation)
+        pending.move_to_end(user_id)
+        
+        # Срок у всех записей одинаковый, поэтому самые старые - в начале
+        while pending:
+            expires_at, _ = next(iter(pending.values()))
+            if expires_at > now and len(pending) <= MAX_PENDING_CONFIRMATIONS:
+                break
+            pending.popitem(last=False)
+    
+    def _get_confirmation(self, user_id: int) -> Optional[Dict]:
+        """
+        Получить ожидающее подтверждение пользователя
+        
+        Args:
+            user_id: ID пользователя
+        
+        Returns:
+            Данные подтверждения или None если его нет или оно устарело
+        """
+        entry = self.pending_confirmations.get(user_id)
+        if entry is None:
+            return None
+        
+        expires_at, confirmation = entry
+        if expires_at <= time.monotonic():
+            self.pending_confirmations.pop(user_id, None)
+            return None
+        
+        return confirmation
+    
     async def clear_db_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /clear_db - очистить БД (только для админа)"""
         user_id = update.effective_user.id
@@ -433,13 +866,14 @@ class TelegramBot:
             return  # Просто игнорируем команду для обычных пользователей
         
         # Проверяем есть ли уже pending подтверждение
-        if user_id in self.pending_confirmations and self.pending_confirmations[user_id].get('action') == 'clear_db':
+        confirmation = self._get_confirmation(user_id)
+        if confirmation and confirmation.get('action') == 'clear_db':
             # Это второе подтверждение
             await self._execute_clear_db(update)
             self.pending_confirmations.pop(user_id, None)
         else:
             # Первое подтверждение
-            self.pending_confirmations[user_id] = {'action': 'clear_db'}
+            self._set_confirmation(user_id, {'action': 'clear_db'})
             
             keyboard = [
                 [
@@ -478,7 +912,7 @@ class TelegramBot:
             for order in orders:
                 keyboard.append([
                     InlineKeyboardButton(
-                        f"📋 Заказ #{order['code']} - {order['total_price']:,.0f} ₸",
+                        f"📋 Заказ #{order['code']} - {_format_kzt(order['total_price'])}",
                         callback_data=f"waybill:{order['id']}:{order['code']}"
                     )
                 ])
@@ -493,7 +927,7 @@ class TelegramBot:
             )
             
         except Exception as e:
-            logger.error(f"Ошибка при получении списка для накладных: {e}")
+            logger.error("Ошибка при получении списка для накладных: %s", e)
             await update.message.reply_text(
                 "❌ Произошла ошибка при получении списка заказов"
             )
@@ -503,17 +937,17 @@ class TelegramBot:
         try:
             await update.message.reply_text("⏳ Очищаю базу данных...", parse_mode='HTML')
             
-            count = self.order_service.clear_database()
+            count = await asyncio.to_thread(self.order_service.clear_database)
             
             await update.message.reply_text(
                 f"✅ <b>База данных очищена</b>\n\n"
                 f"Удалено записей: {count}",
                 parse_mode='HTML'
             )
-            logger.info(f"База данных очищена администратором")
+            logger.info("База данных очищена администратором")
             
         except Exception as e:
-            logger.error(f"Ошибка при очистке БД: {e}")
+            logger.error("Ошибка при очистке БД: %s", e)
             await update.message.reply_text(
                 f"❌ Ошибка при очистке базы данных:\n{str(e)}",
                 parse_mode='HTML'
@@ -524,92 +958,95 @@ class TelegramBot:
         query = update.callback_query
         await query.answer()
         
-        callback_data = query.data
-        user_id = query.from_user.id
+        # Префикс до первого ":" определяет действие, остальное - его параметры
+        action, _, params = query.data.partition(":")
+        handler = self._callback_handlers.get(action)
+        if handler:
+            await handler(query, query.from_user.id, params)
+    
+    async def _cb_download_waybill(self, query, user_id: int, params: str):
+        """Скачать и отправить PDF накладной (download_waybill:<код>)"""
+        order_code = params
         
-        # Скачать и отправить PDF накладной
-        if callback_data.startswith("download_waybill:"):
-            order_code = callback_data.split(":")[1]
-            
-            # Отправляем новое сообщение
-            status_msg = await query.message.reply_text(
-                f"⏳ Получаю накладную для заказа #{order_code}...",
-                parse_mode='HTML'
-            )
-            
-            # Сначала пробуем из БД
-            await self.send_waybill_from_db(order_code, query.message.chat_id)
-            
-            # Удаляем статусное сообщение
-            await status_msg.delete()
-            
-            # Подтверждаем нажатие кнопки
-            await query.answer("✅ Накладная отправлена")
+        # Отправляем новое сообщение
+        status_msg = await query.message.reply_text(
+            f"⏳ Получаю накладную для заказа #{order_code}...",
+            parse_mode='HTML'
+        )
         
-        # Обработка принятия заказа
-        elif callback_data.startswith("accept_order:"):
-            _, order_id, order_code = callback_data.split(":")
-            await self.handle_accept_order(query, order_id, order_code)
+        # Сначала пробуем из БД
+        await self.send_waybill_from_db(order_code, query.message.chat_id)
         
-        # Обработка формирования накладной - отправляем НОВОЕ сообщение с подтверждением
-        elif callback_data.startswith("waybill:"):
-            _, order_id, order_code = callback_data.split(":")
-            # Сохраняем для подтверждения
-            self.pending_confirmations[user_id] = {
-                'action': 'create_waybill',
-                'order_id': order_id,
-                'order_code': order_code
-            }
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("✅ Да, сформировать", callback_data=f"confirm_waybill:{order_id}:{order_code}"),
-                    InlineKeyboardButton("❌ Отмена", callback_data="cancel_action")
-                ]
+        # Удаляем статусное сообщение
+        await status_msg.delete()
+        
+        # Подтверждаем нажатие кнопки
+        await query.answer("✅ Накладная отправлена")
+    
+    async def _cb_accept_order(self, query, user_id: int, params: str):
+        """Обработка принятия заказа (accept_order:<id>:<код>)"""
+        order_id, _, order_code = params.partition(":")
+        await self.handle_accept_order(query, order_id, order_code)
+    
+    async def _cb_waybill(self, query, user_id: int, params: str):
+        """Запрос подтверждения формирования накладной (waybill:<id>:<код>)"""
+        order_id, _, order_code = params.partition(":")
+        # Сохраняем для подтверждения
+        self._set_confirmation(user_id, {
+            'action': 'create_waybill',
+            'order_id': order_id,
+            'order_code': order_code
+        })
+        
+        keyboard = [
+            [
+                InlineKeyboardButton("✅ Да, сформировать", callback_data=f"confirm_waybill:{order_id}:{order_code}"),
+                InlineKeyboardButton("❌ Отмена", callback_data="cancel_action")
             ]
-            
-            # ОТПРАВЛЯЕМ НОВОЕ СООБЩЕНИЕ вместо редактирования существующего
-            await query.message.reply_text(
-                f"⚠️ <b>Подтверждение формирования накладной</b>\n\n"
-                f"Заказ: #{order_code}\n\n"
-                f"После формирования накладной:\n"
-                f"• Статус заказа изменится на ASSEMBLE (Передача)\n"
-                f"• Заказ будет готов к отправке в Kaspi Доставку\n"
-                f"• Накладная станет доступна для скачивания\n\n"
-                f"Продолжить?",
-                parse_mode='HTML',
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+        ]
         
-        # Подтверждение формирования накладной
-        elif callback_data.startswith("confirm_waybill:"):
-            _, order_id, order_code = callback_data.split(":")
-            self.pending_confirmations.pop(user_id, None)
-            
-            # Удаляем кнопки с сообщения подтверждения
-            await query.edit_message_reply_markup(reply_markup=None)
-            
-            await self.handle_create_waybill(query, order_id, order_code)
+        # ОТПРАВЛЯЕМ НОВОЕ СООБЩЕНИЕ вместо редактирования существующего
+        await query.message.reply_text(
+            f"⚠️ <b>Подтверждение формирования накладной</b>\n\n"
+            f"Заказ: #{order_code}\n\n"
+            f"После формирования накладной:\n"
+            f"• Статус заказа изменится на ASSEMBLE (Передача)\n"
+            f"• Заказ будет готов к отправке в Kaspi Доставку\n"
+            f"• Накладная станет доступна для скачивания\n\n"
+            f"Продолжить?",
+            parse_mode='HTML',
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    
+    async def _cb_confirm_waybill(self, query, user_id: int, params: str):
+        """Подтверждение формирования накладной (confirm_waybill:<id>:<код>)"""
+        order_id, _, order_code = params.partition(":")
+        self.pending_confirmations.pop(user_id, None)
         
-        # Подтверждение очистки БД
-        elif callback_data == "confirm_clear_db":
-            if user_id not in self.admin_ids:
-                await query.answer("❌ Доступ запрещен", show_alert=True)
-                return
-            
-            await query.edit_message_text(
-                "✅ Первое подтверждение получено.\n\n"
-                "Отправьте команду /clear_db еще раз для окончательного подтверждения.",
-                parse_mode='HTML'
-            )
+        # Удаляем кнопки с сообщения подтверждения
+        await query.edit_message_reply_markup(reply_markup=None)
         
-        # Отмена действия
-        elif callback_data in ["cancel_action", "cancel_clear_db"]:
-            self.pending_confirmations.pop(user_id, None)
-            await query.edit_message_text(
-                "❌ Действие отменено",
-                parse_mode='HTML'
-            )
+        await self.handle_create_waybill(query, order_id, order_code)
+    
+    async def _cb_confirm_clear_db(self, query, user_id: int, params: str):
+        """Первое подтверждение очистки БД (confirm_clear_db)"""
+        if user_id not in self.admin_ids:
+            await query.answer("❌ Доступ запрещен", show_alert=True)
+            return
+        
+        await query.edit_message_text(
+            "✅ Первое подтверждение получено.\n\n"
+            "Отправьте команду /clear_db еще раз для окончательного подтверждения.",
+            parse_mode='HTML'
+        )
+    
+    async def _cb_cancel(self, query, user_id: int, params: str):
+        """Отмена действия (cancel_action, cancel_clear_db)"""
+        self.pending_confirmations.pop(user_id, None)
+        await query.edit_message_text(
+            "❌ Действие отменено",
+            parse_mode='HTML'
+        )
     
     async def handle_accept_order(self, query, order_id: str, order_code: str):
         """Обработка принятия заказа"""
@@ -632,7 +1069,7 @@ class TelegramBot:
                     f"Статус изменен на: ACCEPTED_BY_MERCHANT",
                     parse_mode='HTML'
                 )
-                logger.info(f"Заказ {order_code} принят через бота")
+                logger.info("Заказ %s принят через бота", order_code)
             else:
                 await query.message.reply_text(
                     f"❌ Ошибка при принятии заказа #{order_code}\n"
@@ -640,7 +1077,7 @@ class TelegramBot:
                     parse_mode='HTML'
                 )
         except Exception as e:
-            logger.error(f"Ошибка при принятии заказа {order_code}: {e}")
+            logger.error("Ошибка при принятии заказа %s: %s", order_code, e)
             await query.message.reply_text(
                 f"❌ Произошла ошибка при принятии заказа #{order_code}:\n{str(e)}",
                 parse_mode='HTML'
@@ -672,29 +1109,23 @@ class TelegramBot:
             
             # Если накладная уже сформирована
             if status == 'ASSEMBLE' or waybill_url:
-                message = f"ℹ️ <b>Накладная для заказа #{order_code} уже сформирована</b>\n\n"
-                message += f"Статус: {status}\n"
-                
                 if waybill_url:
-                    message += "\nНакладная доступна:"
-                    keyboard = [[
-                        InlineKeyboardButton("📄 Скачать онлайн", url=waybill_url),
-                        InlineKeyboardButton("📥 Получить PDF", callback_data=f"download_waybill:{order_code}")
-                    ]]
                     await query.message.reply_text(
-                        message,
+                        WAYBILL_EXISTS_TEMPLATE.format(code=order_code, status=status, tail=WAYBILL_READY_TAIL),
                         parse_mode='HTML',
-                        reply_markup=InlineKeyboardMarkup(keyboard)
+                        reply_markup=_waybill_keyboard(waybill_url, order_code)
                     )
                     
                     # Скачиваем и сохраняем PDF если его еще нет в БД
-                    if not self.order_service.db.get_order_waybill_pdf(order_code):
+                    if not await asyncio.to_thread(self.order_service.db.has_order_waybill_pdf, order_code):
                         await self.download_and_send_waybill(waybill_url, order_code, query.message.chat_id)
                 else:
-                    message += "\nНакладная будет доступна в личном кабинете Kaspi."
-                    await query.message.reply_text(message, parse_mode='HTML')
+                    await query.message.reply_text(
+                        WAYBILL_EXISTS_TEMPLATE.format(code=order_code, status=status, tail=WAYBILL_PENDING_TAIL),
+                        parse_mode='HTML'
+                    )
                 
-                logger.info(f"Накладная для заказа {order_code} уже была сформирована")
+                logger.info("Накладная для заказа %s уже была сформирована", order_code)
                 return
             
             # Проверяем что заказ принят
@@ -707,7 +1138,7 @@ class TelegramBot:
                 return
             
             # Проверяем что заказ не завершен
-            if status in ['COMPLETED', 'CANCELLED', 'CANCELLING']:
+            if status in FINISHED_STATUSES:
                 await query.message.reply_text(
                     f"❌ <b>Заказ #{order_code} уже завершен</b>\n\n"
                     f"Статус: {status}\n"
@@ -726,41 +1157,33 @@ class TelegramBot:
             number_of_spaces = 1
             
             # Формируем накладную через API
-            result = await self.order_service.create_waybill(order_id, number_of_spaces)
+            result = await self.order_service.create_waybill(order_id, number_of_spaces, order_code=order_code)
             
             if result:
                 # Получаем URL накладной
                 waybill_url = result.get('waybill_url')
                 
-                success_message = (
-                    f"✅ <b>Накладная для заказа #{order_code} сформирована!</b>\n\n"
-                    f"Количество мест: {number_of_spaces}\n"
-                    f"Статус изменен на: ASSEMBLE (Передача)\n\n"
-                )
-                
                 # Если есть URL накладной, добавляем кнопки и скачиваем PDF
                 if waybill_url:
-                    success_message += "Накладная доступна:"
-                    keyboard = [[
-                        InlineKeyboardButton("📄 Скачать онлайн", url=waybill_url),
-                        InlineKeyboardButton("📥 Получить PDF", callback_data=f"download_waybill:{order_code}")
-                    ]]
                     await query.message.reply_text(
-                        success_message,
+                        WAYBILL_SUCCESS_TEMPLATE.format(
+                            code=order_code, spaces=number_of_spaces, tail=WAYBILL_READY_TAIL
+                        ),
                         parse_mode='HTML',
-                        reply_markup=InlineKeyboardMarkup(keyboard)
+                        reply_markup=_waybill_keyboard(waybill_url, order_code)
                     )
                     
                     # Скачиваем и сохраняем PDF
                     await self.download_and_send_waybill(waybill_url, order_code, query.message.chat_id)
                 else:
-                    success_message += "Накладная будет доступна в личном кабинете Kaspi через несколько минут."
                     await query.message.reply_text(
-                        success_message,
+                        WAYBILL_SUCCESS_TEMPLATE.format(
+                            code=order_code, spaces=number_of_spaces, tail=WAYBILL_PENDING_SOON_TAIL
+                        ),
                         parse_mode='HTML'
                     )
                 
-                logger.info(f"Накладная для заказа {order_code} сформирована через бота")
+                logger.info("Накладная для заказа %s сформирована через бота", order_code)
             else:
                 await query.message.reply_text(
                     f"❌ Ошибка при формировании накладной для заказа #{order_code}\n"
@@ -768,7 +1191,7 @@ class TelegramBot:
                     parse_mode='HTML'
                 )
         except Exception as e:
-            logger.error(f"Ошибка при формировании накладной {order_code}: {e}")
+            logger.error("Ошибка при формировании накладной %s: %s", order_code, e)
             await query.message.reply_text(
                 f"❌ Произошла ошибка при формировании накладной #{order_code}:\n{str(e)}",
                 parse_mode='HTML'
@@ -776,11 +1199,9 @@ class TelegramBot:
     
     async def send_startup_message(self, context: ContextTypes.DEFAULT_TYPE):
         try:
-            startup_message = (
-                "🤖 <b>Бот запущен!</b>\n\n"
-                "Мониторинг заказов Kaspi активирован.\n"
-                "Проверка новых заказов каждые 10 минут.\n\n"
-                f"Дата и время запуска: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"
+            startup_message = STARTUP_TEMPLATE.format(
+                interval=self._base_interval // 60,
+                started=datetime.now(LOCAL_TZ).strftime(DATETIME_SECONDS_FORMAT)
             )
             await self.application.bot.send_message(
                 chat_id=self.chat_id,
@@ -789,63 +1210,118 @@ class TelegramBot:
             )
             logger.info("Приветственное сообщение отправлено")
         except Exception as e:
-            logger.error(f"Ошибка при отправке приветственного сообщения: {e}")
+            logger.error("Ошибка при отправке приветственного сообщения: %s", e)
     
-    async def check_new_orders(self, context: ContextTypes.DEFAULT_TYPE):
+    async def check_new_orders(self, context: Optional[ContextTypes.DEFAULT_TYPE] = None):
         """
-        Периодическая проверка новых заказов (запускается по расписанию)
+        Проверка новых заказов (запускается периодически из _poll_orders_loop)
         """
         try:
             logger.info("Проверка новых заказов...")
+            # Уже обработанные заказы отбрасывает OrderService (по множеству кодов в памяти)
             new_orders = await self.order_service.get_new_orders()
             
             if new_orders:
-                logger.info(f"Найдено новых заказов: {len(new_orders)}")
+                logger.info("Найдено новых заказов: %d", len(new_orders))
                 
                 # Фильтруем заказы - отправляем уведомления только для активных
-                active_statuses = [
-                    'APPROVED_BY_BANK',      # Новый заказ, ждет принятия
-                    'ACCEPTED_BY_MERCHANT',  # Принят продавцом
-                    'ASSEMBLE',              # Передача в доставку
-                    'PICKUP'                 # Готов к выдаче
-                ]
-                
                 orders_to_notify = [
                     order for order in new_orders 
-                    if order.get('status') in active_statuses
+                    if order.get('status') in ACTIVE_STATUSES
                 ]
                 
                 orders_archived = len(new_orders) - len(orders_to_notify)
                 
-                logger.info(f"Заказов для уведомления: {len(orders_to_notify)}")
+                logger.info("Заказов для уведомления: %d", len(orders_to_notify))
                 if orders_archived > 0:
-                    logger.info(f"Пропущено архивных/завершенных заказов: {orders_archived}")
+                    logger.info("Пропущено архивных/завершенных заказов: %d", orders_archived)
                 
-                # СНАЧАЛА сохраняем ВСЕ заказы и отмечаем как обработанные
-                for order in new_orders:
-                    self.order_service.save_order_to_db(order)
-                    self.order_service.mark_order_notified(order['code'])
+                # Заказы уже сохранены и отмечены как обработанные в get_new_orders,
+                # ПОТОМ отправляем уведомления ТОЛЬКО для активных заказов - параллельно,
+                # ограничивая число одновременных запросов к Telegram
+                semaphore = asyncio.Semaphore(NOTIFICATION_CONCURRENCY)
                 
-                # ПОТОМ отправляем уведомления ТОЛЬКО для активных заказов
-                for order in orders_to_notify:
-                    try:
+                async def notify(order: Dict):
+                    async with semaphore:
                         await self.send_order_notification(order)
-                        logger.info(f"Уведомление отправлено для заказа {order['code']}")
-                        # Небольшая задержка между сообщениями чтобы избежать flood control
-                        import asyncio
-                        await asyncio.sleep(1)
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке уведомления о заказе {order['code']}: {e}")
+                
+                # Заказы с кнопками (принять, накладная) отправляются отдельно,
+                # заказы без кнопок - общими сообщениями в этой же проверке
+                orders_with_buttons = []
+                orders_without_buttons = []
+                for order in orders_to_notify:
+                    if _keyboard_for_order(order) is None:
+                        orders_without_buttons.append(order)
+                    else:
+                        orders_with_buttons.append(order)
+                
+                results = await asyncio.gather(
+                    *(notify(order) for order in orders_with_buttons),
+                    return_exceptions=True
+                )
+                
+                for order, result in zip(orders_with_buttons, results):
+                    if isinstance(result, Exception):
+                        logger.error("Ошибка при отправке уведомления о заказе %s: %s", order['code'], result)
+                    else:
+                        logger.debug("Уведомление отправлено для заказа %s", order['code'])
+                
+                if orders_without_buttons:
+                    await self.send_orders_batch(orders_without_buttons)
                 
             else:
                 logger.info("Новых заказов не найдено")
+            
+            self._adjust_poll_interval(bool(new_orders))
                 
         except Exception as e:
-            logger.error(f"Ошибка при проверке новых заказов: {e}", exc_info=True)
+            self._errors.error("Ошибка при проверке новых заказов", e)
+    
+    def _adjust_poll_interval(self, found_orders: bool):
+        """
+        Адаптировать интервал проверки заказов
+        
+        Пока новых заказов нет, интервал удваивается (до максимального),
+        при появлении заказа - возвращается к базовому. Новый интервал
+        применяется к следующей паузе в _poll_orders_loop
+        
+        Args:
+            found_orders: Были ли найдены новые заказы при последней проверке
+        """
+        if not self._base_interval:
+            return
+        
+        old_interval = self._current_interval()
+        if found_orders:
+            self._empty_streak = 0
+        elif old_interval < self._max_interval:
+            self._empty_streak += 1
+        new_interval = self._current_interval()
+        
+        if new_interval != old_interval:
+            logger.info("Интервал проверки заказов изменен: %d → %d мин", old_interval // 60, new_interval // 60)
+    
+    def _current_interval(self) -> int:
+        """Текущий интервал проверки заказов в секундах с учетом серии пустых проверок"""
+        return min(self._base_interval * 2 ** self._empty_streak, self._max_interval)
     
     def setup(self):
         """Настроить бота и обработчики команд"""
-        self.application = Application.builder().token(self.token).build()
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+            # Пул соединений к Telegram по умолчанию 256, но свободное соединение при
+            # всплеске отправок ждем дольше стандартной секунды, а не падаем с PoolTimeout
+            .pool_timeout(TELEGRAM_POOL_TIMEOUT)
+            # Общий лимит запросов к Telegram (30 в секунду, 20 в минуту для групп)
+            # с автоматическим повтором после RetryAfter
+            .rate_limiter(AIORateLimiter(max_retries=SEND_MAX_RETRIES))
+            .post_init(self._post_init)
+            .post_stop(self._post_stop)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         
         # Добавляем обработчики команд
         self.application.add_handler(CommandHandler("start", self.start_command))
@@ -861,19 +1337,55 @@ class TelegramBot:
         
         logger.info("Telegram бот настроен")
     
-    def add_job_check_orders(self, interval_minutes: int):
+    async def _post_init(self, application: Application):
+        """Запустить периодическую проверку заказов, если она настроена"""
+        if self._base_interval:
+            self._poll_task = asyncio.create_task(self._poll_orders_loop())
+    
+    async def _poll_orders_loop(self):
+        """
+        Периодическая проверка новых заказов
+        
+        Пауза отсчитывается от начала проверки, поэтому долгая проверка сокращает
+        следующую паузу, но проверки никогда не идут одновременно
+        """
+        await asyncio.sleep(FIRST_CHECK_DELAY)
+        while True:
+            started = time.monotonic()
+            await self.check_new_orders()
+            
+            interval = self._current_interval()
+            delay = interval - (time.monotonic() - started)
+            delay += random.uniform(-POLL_JITTER, POLL_JITTER) * interval
+            await asyncio.sleep(max(0.0, delay))
+    
+    async def _post_stop(self, application: Application):
+        """Остановить периодическую проверку заказов"""
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+    
+    async def _post_shutdown(self, application: Application):
+        """Закрыть HTTP соединения с сервером накладных и Kaspi API"""
+        await self.order_service.aclose()
+        await self.order_service.kaspi.aclose()
+        logger.info("HTTP клиент Kaspi API закрыт")
+    
+    def add_job_check_orders(self, interval_minutes: int, max_interval_minutes: int = None):
         """
         Добавить задачу периодической проверки заказов
         
+        Проверка запускается фоновой задачей при старте бота (см. _poll_orders_loop)
+        
         Args:
             interval_minutes: Интервал проверки в минутах
+            max_interval_minutes: Максимальный интервал при отсутствии новых заказов
+                                  (по умолчанию равен interval_minutes - без адаптации)
         """
-        self.application.job_queue.run_repeating(
-            self.check_new_orders,
-            interval=interval_minutes * 60,
-            first=10  # Первая проверка через 10 секунд после запуска
-        )
-        logger.info(f"Настроена периодическая проверка заказов каждые {interval_minutes} минут")
+        self._base_interval = interval_minutes * 60
+        self._max_interval = max(max_interval_minutes or interval_minutes, interval_minutes) * 60
+        self._empty_streak = 0
+        logger.info("Настроена периодическая проверка заказов каждые %s минут", interval_minutes)
     
     def run(self):
         """Запустить бота"""
@@ -882,4 +1394,10 @@ class TelegramBot:
         # Планируем отправку приветственного сообщения
         self.application.job_queue.run_once(self.send_startup_message, when=2)
         
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
\ No newline at end of file
+        # Long polling: getUpdates ждет новых событий до 30 секунд на стороне Telegram,
+        # вместо частых пустых запросов
+        self.application.run_polling(
+            allowed_updates=Update.ALL_TYPES,
+            poll_interval=0.0,
+            timeout=30
+        )
\ No newline at end of file
@@ -2,39 +2,65 @@
 Конфигурация приложения
 """
 import os
+from dataclasses import dataclass
+from typing import Optional
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения
 load_dotenv()
 
 
+@dataclass(frozen=True, slots=True)
 class Config:
-    """Основные настройки приложения"""
+    """Основные настройки приложения (неизменяемые, читаются из окружения один раз)"""
     
     # Telegram
-    TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-    TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+    TELEGRAM_BOT_TOKEN: Optional[str]
+    TELEGRAM_CHAT_ID: Optional[str]
     
     # Kaspi API
-    KASPI_API_TOKEN = os.getenv('KASPI_API_TOKEN')
-    KASPI_API_URL = os.getenv('KASPI_API_URL', 'https://kaspi.kz/shop/api/v2')
+    KASPI_API_TOKEN: Optional[str]
+    KASPI_API_URL: str
     
     # Настройки опроса
-    POLL_INTERVAL_MINUTES = int(os.getenv('POLL_INTERVAL_MINUTES', '10'))
+    POLL_INTERVAL_MINUTES: int
+    
+    # Максимальный интервал опроса - при отсутствии новых заказов интервал
+    # удваивается до этого значения и сбрасывается при появлении заказа.
+    # По умолчанию равен POLL_INTERVAL_MINUTES, т.е. интервал не меняется
+    POLL_INTERVAL_MAX_MINUTES: int
     
     # Период запроса заказов (максимум 14 дней для Kaspi API)
-    ORDERS_DAYS_BACK = int(os.getenv('ORDERS_DAYS_BACK', '14'))
+    ORDERS_DAYS_BACK: int
+    
+    # Уровень логирования (в продакшене можно WARNING - info-сообщения тогда почти ничего не стоят)
+    LOG_LEVEL: str
     
     # База данных
-    DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///kaspi_orders.db')
+    DATABASE_URL: str
     
     @classmethod
-    def validate(cls):
+    def from_env(cls) -> 'Config':
+        """Прочитать настройки из переменных окружения"""
+        poll_interval = int(os.getenv('POLL_INTERVAL_MINUTES', '10'))
+        return cls(
+            TELEGRAM_BOT_TOKEN=os.getenv('TELEGRAM_BOT_TOKEN'),
+            TELEGRAM_CHAT_ID=os.getenv('TELEGRAM_CHAT_ID'),
+            KASPI_API_TOKEN=os.getenv('KASPI_API_TOKEN'),
+            KASPI_API_URL=os.getenv('KASPI_API_URL', 'https://kaspi.kz/shop/api/v2'),
+            POLL_INTERVAL_MINUTES=poll_interval,
+            POLL_INTERVAL_MAX_MINUTES=int(os.getenv('POLL_INTERVAL_MAX_MINUTES', str(poll_interval))),
+            ORDERS_DAYS_BACK=int(os.getenv('ORDERS_DAYS_BACK', '14')),
+            LOG_LEVEL=os.getenv('LOG_LEVEL', 'INFO').upper(),
+            DATABASE_URL=os.getenv('DATABASE_URL', 'sqlite:///kaspi_orders.db'),
+        )
+    
+    def validate(self):
         """Проверка наличия обязательных переменных"""
         required = {
-            'TELEGRAM_BOT_TOKEN': cls.TELEGRAM_BOT_TOKEN,
-            'KASPI_API_TOKEN': cls.KASPI_API_TOKEN,
-            'TELEGRAM_CHAT_ID': cls.TELEGRAM_CHAT_ID,
+            'TELEGRAM_BOT_TOKEN': self.TELEGRAM_BOT_TOKEN,
+            'KASPI_API_TOKEN': self.KASPI_API_TOKEN,
+            'TELEGRAM_CHAT_ID': self.TELEGRAM_CHAT_ID,
         }
         
         missing = [key for key, value in required.items() if not value]
@@ -44,3 +70,7 @@ class Config:
                 f"Отсутствуют обязательные переменные окружения: {', '.join(missing)}\n"
                 f"Скопируйте .env.example в .env и заполните необходимые значения"
             )
+
+
+# Настройки приложения (проверяются через CONFIG.validate() при запуске)
+CONFIG = Config.from_env()
@@ -3,19 +3,63 @@
 """
 import logging
 import json
+import threading
 import base64
+import time
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
 from datetime import datetime
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, Float, Boolean, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from typing import Dict, List, Set
+from sqlalchemy import (
+    create_engine, event, inspect, text, select, update, exists, Column, String, Integer, DateTime, Float, Boolean, Text,
+    Index, ForeignKey, LargeBinary, TypeDecorator
+)
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker, relationship
 
 Base = declarative_base()
 logger = logging.getLogger(__name__)
 
+# Компактный JSON для items_json - без пробелов после разделителей
+JSON_SEPARATORS = (',', ':')
+
+# Сколько секунд переиспользовать выборку активных заказов (сбрасывается при записи)
+ACTIVE_ORDERS_CACHE_TTL = 30.0
+
+# Префикс сжатого PDF накладной (несжатые PDF начинаются с %PDF) и уровень сжатия zlib
+WAYBILL_COMPRESSED_MAGIC = b'ZPDF'
+WAYBILL_COMPRESS_LEVEL = 6
+
+
+class CompressedPDF(TypeDecorator):
+    """
+    PDF, хранящийся в БД сжатым zlib
+    
+    Сжатые данные помечаются WAYBILL_COMPRESSED_MAGIC; если сжатие не уменьшает размер,
+    PDF хранится как есть. Ранее сохраненные несжатые PDF читаются без изменений
+    """
+    impl = LargeBinary
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        packed = WAYBILL_COMPRESSED_MAGIC + zlib.compress(value, WAYBILL_COMPRESS_LEVEL)
+        return packed if len(packed) < len(value) else value
+    
+    def process_result_value(self, value, dialect):
+        if value is not None and value.startswith(WAYBILL_COMPRESSED_MAGIC):
+            return zlib.decompress(value[len(WAYBILL_COMPRESSED_MAGIC):])
+        return value
+
 
 class Order(Base):
     """Модель заказа"""
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Выборка активных заказов фильтрует по статусу и состоянию
+        Index('ix_orders_status_state', 'status', 'state'),
+    )
     
     id = Column(String, primary_key=True)
     code = Column(String, unique=True, nullable=False)
@@ -35,9 +79,11 @@ class Order(Base):
     is_kaspi_delivery = Column(Boolean, default=False)
     is_express = Column(Boolean, default=False)  # Экспресс-доставка
     waybill_url = Column(String)  # URL накладной
-    waybill_pdf = Column(Text)  # PDF накладной в base64
     items_json = Column(Text)  # JSON с товарами
     
+    # PDF накладной лежит в отдельной таблице и читается только явными запросами
+    waybill = relationship('OrderWaybill', uselist=False, lazy='noload')
+    
     def __repr__(self):
         return f"<Order(code={self.code}, status={self.status})>"
     
@@ -55,161 +101,312 @@ class Order(Base):
     def items(self, value):
         """Сохранить товары в JSON"""
         if value:
-            self.items_json = json.dumps(value, ensure_ascii=False)
+            self.items_json = json.dumps(value, ensure_ascii=False, separators=JSON_SEPARATORS)
         else:
             self.items_json = None
+
+
+class OrderWaybill(Base):
+    """PDF накладной заказа (отдельно от orders, чтобы не читать блоб с каждой строкой)"""
+    __tablename__ = 'order_waybills'
+    
+    order_code = Column(String, ForeignKey('orders.code'), primary_key=True)
+    pdf = Column(CompressedPDF, nullable=False)
+    
+    def __repr__(self):
+        return f"<OrderWaybill(order_code={self.order_code}, size={len(self.pdf or b'')})>"
+
+
+@dataclass(slots=True)
+class OrderView:
+    """
+    Легкое представление заказа для списков (без ORM-объекта и его состояния)
+    
+    Содержит только поля, которые выводят /active и /waybills.
+    Заполняется напрямую из строки выборки по ORDER_VIEW_COLUMNS
+    """
+    id: str
+    code: str
+    status: str
+    total_price: float
+    customer_name: str
+    delivery_mode: str
+    delivery_address: str
+    warehouse_name: str
+    planned_delivery_date: datetime
+    created_at: datetime
+    is_kaspi_delivery: bool
+    is_express: bool
+    waybill_url: str
+    items_json: str
     
     @property
-    def waybill_pdf_bytes(self):
-        """Получить PDF как bytes"""
-        if self.waybill_pdf:
+    def items(self):
+        """Получить товары из JSON"""
+        if self.items_json:
             try:
-                return base64.b64decode(self.waybill_pdf)
-            except:
-                return None
-        return None
+                return json.loads(self.items_json)
+            except ValueError:
+                return []
+        return []
+
+
+# Колонки Order в порядке полей OrderView
+ORDER_VIEW_COLUMNS = tuple(getattr(Order, field.name) for field in fields(OrderView))
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Настройки SQLite для каждого нового соединения
     
-    @waybill_pdf_bytes.setter
-    def waybill_pdf_bytes(self, value):
-        """Сохранить PDF из bytes"""
-        if value:
-            self.waybill_pdf = base64.b64encode(value).decode('utf-8')
-        else:
-            self.waybill_pdf = None
+    WAL позволяет читать во время записи, а synchronous=NORMAL в режиме WAL
+    делает fsync только при checkpoint, а не на каждый commit
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=134217728")  # 128 МБ
+    cursor.execute("PRAGMA cache_size=-65536")  # 64 МБ
+    cursor.close()
 
 
 class Database:
     """Класс для работы с базой данных"""
     
     def __init__(self, database_url: str):
-        self.engine = create_engine(database_url)
+        if database_url.startswith('sqlite'):
+            # Соединения из пула используются разными потоками (asyncio.to_thread)
+            self.engine = create_engine(database_url, connect_args={'check_same_thread': False})
+            event.listen(self.engine, 'connect', _set_sqlite_pragmas)
+        else:
+            self.engine = create_engine(database_url)
         Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
+        
+        # create_all не добавляет индексы в уже существующую таблицу - создаем недостающие
+        for index in Order.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
+        self._migrate_waybill_pdfs()
+        # Сессия на поток (вызовы идут из asyncio.to_thread); без expire_on_commit
+        # возвращенные объекты не перечитываются из БД после commit
+        self.Session = scoped_session(sessionmaker(bind=self.engine, expire_on_commit=False))
+        
+        # (время выборки, список заказов) - см. get_active_orders. Поколение увеличивается
+        # при каждом сбросе: выборка, начатая до записи, не попадает в кэш после нее
+        self._active_cache = (0.0, None)
+        self._active_generation = 0
+        self._active_lock = threading.Lock()
+    
+    def _migrate_waybill_pdfs(self):
+        """
+        Перенести PDF из старой колонки orders.waybill_pdf (base64) в order_waybills
+        
+        Колонка остается в старых базах, но после переноса очищается и больше не используется
+        """
+        columns = {column['name'] for column in inspect(self.engine).get_columns('orders')}
+        if 'waybill_pdf' not in columns:
+            return
+        
+        with self.engine.begin() as connection:
+            rows = connection.execute(text(
+                "SELECT code, waybill_pdf FROM orders WHERE waybill_pdf IS NOT NULL"
+            )).all()
+            if not rows:
+                return
+            
+            existing = set(connection.execute(
+                OrderWaybill.__table__.select().with_only_columns(OrderWaybill.order_code)
+            ).scalars())
+            waybills = []
+            for code, waybill_pdf in rows:
+                if code in existing:
+                    continue
+                try:
+                    waybills.append({'order_code': code, 'pdf': base64.b64decode(waybill_pdf)})
+                except ValueError:
+                    logger.error("Поврежден PDF накладной заказа %s, пропускаем при переносе", code)
+            
+            if waybills:
+                connection.execute(OrderWaybill.__table__.insert(), waybills)
+            connection.execute(text("UPDATE orders SET waybill_pdf = NULL WHERE waybill_pdf IS NOT NULL"))
+            logger.info("Перенесено PDF накладных в order_waybills: %s", len(waybills))
     
     def get_session(self):
-        """Получить сессию БД"""
+        """Получить сессию БД (одна на поток, переиспользуется между вызовами)"""
         return self.Session()
     
-    def is_order_notified(self, order_code: str) -> bool:
-        """Проверить, было ли отправлено уведомление о заказе"""
+    @contextmanager
+    def _session(self):
+        """
+        Сессия для одной операции: commit при успехе, rollback при ошибке
+        
+        Сама сессия не пересоздается - close() лишь возвращает соединение в пул
+        """
         session = self.get_session()
         try:
-            order = session.query(Order).filter_by(code=order_code).first()
-            return order is not None and order.notified_at is not None
-        finally:
-            session.close()
-    
-    def save_order(self, order_data: dict):
-        """Сохранить заказ в БД"""
-        session = self.get_session()
-        try:
-            order = session.query(Order).filter_by(code=order_data['code']).first()
-            
-            # Извлекаем items отдельно для обработки
-            items = order_data.pop('items', None)
-            # Извлекаем waybill_pdf_data если есть
-            waybill_pdf_data = order_data.pop('waybill_pdf_data', None)
-            
-            if order is None:
-                order = Order(**order_data)
-                if items:
-                    order.items = items
-                if waybill_pdf_data:
-                    order.waybill_pdf_bytes = waybill_pdf_data
-                session.add(order)
-            else:
-                # Обновляем существующий заказ
-                for key, value in order_data.items():
-                    setattr(order, key, value)
-                if items:
-                    order.items = items
-                if waybill_pdf_data:
-                    order.waybill_pdf_bytes = waybill_pdf_data
-            
+            yield session
             session.commit()
-        except Exception as e:
+        except Exception:
             session.rollback()
-            raise e
+            raise
         finally:
             session.close()
     
-    def mark_as_notified(self, order_code: str):
-        """Отметить заказ как обработанный (уведомление отправлено)"""
-        session = self.get_session()
-        try:
-            order = session.query(Order).filter_by(code=order_code).first()
-            if order:
-                order.notified_at = datetime.utcnow()
-                session.commit()
-        finally:
-            session.close()
+    def get_all_notified_codes(self) -> Set[str]:
+        """
+        Получить коды всех заказов, о которых уже было уведомление
+        
+        Returns:
+            Множество кодов обработанных заказов
+        """
+        with self._session() as session:
+            return set(session.scalars(select(Order.code).where(Order.notified_at.isnot(None))))
+    
+    def save_orders_bulk(self, orders: List[dict]):
+        """
+        Сохранить пачку заказов и отметить их как обработанные одной транзакцией
+        
+        Вместо SELECT + INSERT/UPDATE + отдельного UPDATE notified_at на каждый заказ:
+        один SELECT существующих кодов, bulk insert новых и bulk update существующих
+        
+        Args:
+            orders: Список словарей с данными заказов (поля Order, items и waybill_pdf_data)
+        """
+        if not orders:
+            return
+        
+        now = datetime.utcnow()
+        
+        # Готовим строки заранее: товары в JSON (как в свойстве Order.items), PDF - отдельно
+        payloads = {}
+        pdfs = {}
+        for order_data in orders:
+            payload = dict(order_data)
+            items = payload.pop('items', None)
+            waybill_pdf_data = payload.pop('waybill_pdf_data', None)
+            if items:
+                payload['items_json'] = json.dumps(items, ensure_ascii=False, separators=JSON_SEPARATORS)
+            if waybill_pdf_data:
+                pdfs[payload['code']] = waybill_pdf_data
+            payload['notified_at'] = now
+            payloads[payload['code']] = payload
+        
+        with self._session() as session:
+            existing = dict(
+                session.query(Order.code, Order.id).filter(Order.code.in_(list(payloads)))
+            )
+            
+            new_rows = []
+            updated_rows = []
+            for code, payload in payloads.items():
+                if code in existing:
+                    # Обновление по первичному ключу существующей строки
+                    payload['id'] = existing[code]
+                    updated_rows.append(payload)
+                else:
+                    payload.setdefault('created_at', now)
+                    new_rows.append(payload)
+            
+            if new_rows:
+                session.bulk_insert_mappings(Order, new_rows)
+            if updated_rows:
+                session.bulk_update_mappings(Order, updated_rows)
+            for code, pdf in pdfs.items():
+                session.merge(OrderWaybill(order_code=code, pdf=pdf))
+        self._invalidate_active_cache()
     
     def get_active_orders(self) -> list:
-        """Получить активные заказы (не переданные в доставку)"""
-        session = self.get_session()
-        try:
-            orders = session.query(Order).filter(
-                Order.status.in_(['APPROVED_BY_BANK', 'ACCEPTED_BY_MERCHANT', 'ASSEMBLE']),
-                Order.state.in_(['NEW', 'PICKUP', 'DELIVERY', 'KASPI_DELIVERY'])
-            ).all()
+        """
+        Получить активные заказы (не переданные в доставку)
+        
+        Выборка переиспользуется ACTIVE_ORDERS_CACHE_TTL секунд, любая запись в заказы
+        сбрасывает кэш
+        
+        Returns:
+            Список OrderView (общий для вызывающих - не изменять)
+        """
+        cached_at, orders = self._active_cache
+        if orders is not None and time.monotonic() - cached_at < ACTIVE_ORDERS_CACHE_TTL:
             return orders
-        finally:
-            session.close()
+        
+        generation = self._active_generation
+        with self._session() as session:
+            rows = session.execute(
+                select(*ORDER_VIEW_COLUMNS).where(
+                    Order.status.in_(['APPROVED_BY_BANK', 'ACCEPTED_BY_MERCHANT', 'ASSEMBLE']),
+                    Order.state.in_(['NEW', 'PICKUP', 'DELIVERY', 'KASPI_DELIVERY'])
+                )
+            )
+            orders = [OrderView(*row) for row in rows]
+        
+        # Вызовы идут из разных потоков: если за время выборки кэш сбрасывали,
+        # результат может быть устаревшим - возвращаем его, но не кэшируем
+        with self._active_lock:
+            if generation == self._active_generation:
+                self._active_cache = (time.monotonic(), orders)
+        return orders
+    
+    def _invalidate_active_cache(self):
+        """Сбросить кэш активных заказов после изменения заказов"""
+        with self._active_lock:
+            self._active_generation += 1
+            self._active_cache = (0.0, None)
     
     def update_order_status(self, order_code: str, new_status: str):
         """Обновить статус заказа в БД"""
-        session = self.get_session()
         try:
-            order = session.query(Order).filter_by(code=order_code).first()
-            if order:
-                order.status = new_status
-                session.commit()
+            with self._session() as session:
+                session.execute(update(Order).where(Order.code == order_code).values(status=new_status))
+            self._invalidate_active_cache()
         except Exception as e:
-            session.rollback()
-            logger.error(f"Ошибка при обновлении статуса заказа {order_code}: {e}")
+            logger.error("Ошибка при обновлении статуса заказа %s: %s", order_code, e)
             raise e
-        finally:
-            session.close()
     
     def update_order_waybill(self, order_code: str, waybill_url: str, waybill_pdf_data: bytes = None):
         """Обновить URL накладной и PDF для заказа"""
-        session = self.get_session()
         try:
-            order = session.query(Order).filter_by(code=order_code).first()
-            if order:
-                order.waybill_url = waybill_url
-                if waybill_pdf_data:
-                    order.waybill_pdf_bytes = waybill_pdf_data
-                session.commit()
+            with self._session() as session:
+                result = session.execute(
+                    update(Order).where(Order.code == order_code).values(waybill_url=waybill_url)
+                )
+                # PDF сохраняем только для существующего заказа
+                if result.rowcount and waybill_pdf_data:
+                    session.merge(OrderWaybill(order_code=order_code, pdf=waybill_pdf_data))
+            self._invalidate_active_cache()
         except Exception as e:
-            session.rollback()
-            logger.error(f"Ошибка при обновлении накладной {order_code}: {e}")
+            logger.error("Ошибка при обновлении накладной %s: %s", order_code, e)
             raise e
-        finally:
-            session.close()
     
-    def get_order_waybill_pdf(self, order_code: str) -> bytes:
-        """Получить PDF накладной из БД"""
-        session = self.get_session()
-        try:
-            order = session.query(Order).filter_by(code=order_code).first()
-            if order:
-                return order.waybill_pdf_bytes
-            return None
-        finally:
-            session.close()
+    def has_order_waybill_pdf(self, order_code: str) -> bool:
+        """Проверить, сохранен ли PDF накладной (без чтения самого PDF)"""
+        with self._session() as session:
+            return session.scalar(select(exists().where(OrderWaybill.order_code == order_code)))
+    
+    def get_orders_waybill_pdfs(self, order_codes: List[str]) -> Dict[str, bytes]:
+        """
+        Получить PDF накладных для нескольких заказов одним запросом
+        
+        Args:
+            order_codes: Коды заказов
+        
+        Returns:
+            Словарь {код заказа: PDF} - только для заказов, у которых PDF есть
+        """
+        with self._session() as session:
+            rows = session.query(OrderWaybill.order_code, OrderWaybill.pdf).filter(
+                OrderWaybill.order_code.in_(order_codes)
+            )
+            return dict(rows)
     
     def clear_all_orders(self) -> int:
         """Удалить все заказы из БД"""
-        session = self.get_session()
         try:
-            count = session.query(Order).count()
-            session.query(Order).delete()
-            session.commit()
+            with self._session() as session:
+                session.query(OrderWaybill).delete(synchronize_session=False)
+                # delete() возвращает число удаленных строк - отдельный COUNT(*) не нужен
+                count = session.query(Order).delete(synchronize_session=False)
+            self._invalidate_active_cache()
             return count
         except Exception as e:
-            session.rollback()
-            logger.error(f"Ошибка при очистке БД: {e}")
+            logger.error("Ошибка при очистке БД: %s", e)
             raise e
-        finally:
-            session.close()
\ No newline at end of file
@@ -1,18 +1,112 @@
 """
 Клиент для работы с Kaspi API
 """
+import asyncio
 import httpx
 import logging
-from typing import Dict, List, Optional
-from datetime import datetime
+import math
+import time
+import orjson
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Путь списка заказов (относительно base_url)
+ORDERS_PATH = "/orders"
+
+# Период запроса заказов по умолчанию - 14 дней (максимум для Kaspi API), в миллисекундах
+ORDERS_PERIOD_MS = 14 * 24 * 60 * 60 * 1000
+
+# Повторы GET запросов при временных ошибках Kaspi (таймаут, обрыв соединения, 429/5xx):
+# всего попыток и пауза перед повтором 0.5, 1, 2... секунд, но не больше RETRY_BACKOFF_MAX
+RETRY_ATTEMPTS = 4
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 8.0
+RETRY_STATUS_CODES = frozenset((429, 502, 503, 504))
+
+# Ответы, в которых учитывается заголовок Retry-After: пауза перед повтором не меньше
+# указанной сервером, а если сервер просит ждать дольше RETRY_AFTER_MAX секунд - не повторяем
+RETRY_AFTER_STATUS_CODES = frozenset((429, 503))
+RETRY_AFTER_MAX = 30.0
+
+# После стольких неудачных запросов подряд (с учетом повторов) к одному виду запросов
+# (например, складам позиций заказа) он считается недоступным и не отправляется
+# CIRCUIT_OPEN_SECONDS секунд - остальные запросы к Kaspi продолжают работать
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_OPEN_SECONDS = 60.0
+
+# Склады меняются редко - ответы о складах переиспользуются час
+WAREHOUSE_CACHE_TTL = 3600.0
+
+# Максимум запомненных ответов о складах (на каждый вид запроса)
+WAREHOUSE_CACHE_SIZE = 256
+
+# Данные товара не меняются - описания товаров переиспользуются сутки,
+# а отсутствующие описания (404) перезапрашиваются через 5 минут
+PRODUCT_CACHE_TTL = 86400.0
+PRODUCT_NOT_FOUND_CACHE_TTL = 300.0
+
+# Максимум запомненных описаний товаров
+PRODUCT_CACHE_SIZE = 10_000
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Создать HTTP клиент для Kaspi API с HTTP/2 и пулом соединений"""
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=60.0,
+        verify=True,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30.0)
+    )
+
+
+def _endpoint(url: str) -> str:
+    """Вид запроса для учета неудач: путь без ID, например /orderentries/*/product"""
+    parts = url.strip('/').split('/')
+    return '/' + '/'.join('*' if index % 2 else part for index, part in enumerate(parts))
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """
+    Пауза из заголовка Retry-After
+    
+    Args:
+        response: Ответ сервера
+    
+    Returns:
+        Секунды ожидания или None, если заголовка нет или он не разбирается
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    # Вместо секунд может быть указана дата
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class KaspiUnavailableError(Exception):
+    """Kaspi API временно недоступен - запросы не отправляются до истечения паузы"""
+
 
 class KaspiAPIClient:
     """Клиент для взаимодействия с Kaspi Merchant API"""
     
-    def __init__(self, api_token: str, base_url: str):
+    def __init__(self, api_token: str, base_url: str, http_client: Optional[httpx.AsyncClient] = None):
+        """
+        Args:
+            api_token: Токен Kaspi API
+            base_url: Базовый URL Kaspi API
+            http_client: Общий HTTP клиент (если не передан, создается собственный)
+        """
         self.api_token = api_token
         self.base_url = base_url
 
@@ -22,9 +116,105 @@ class KaspiAPIClient:
             'X-Auth-Token': api_token,
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
             'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8'
         }
+        
+        # Один HTTP клиент на всё время жизни бота - соединения переиспользуются (keep-alive),
+        # а по HTTP/2 параллельные запросы идут через одно соединение
+        self._client = http_client or create_http_client()
+        self._client.headers.update(self.headers)
+        # Запросы ниже используют пути относительно base_url
+        self._client.base_url = base_url
+        
+        # Для каждого вида запроса: неудачные запросы подряд и время,
+        # до которого такие запросы не отправляются, см. _get
+        self._failures: Dict[str, int] = {}
+        self._circuit_open_until: Dict[str, float] = {}
+        
+        # Кэши складов и товаров: ключ -> (срок действия, Future с ответом), см. _get_cached
+        self._delivery_point_cache = OrderedDict()
+        self._point_of_service_cache = OrderedDict()
+        self._product_cache = OrderedDict()
+        
+        # Выполняющиеся некэшируемые GET запросы: путь -> общий Future, см. _get_json_shared
+        self._inflight: Dict[str, asyncio.Future] = {}
+    
+    async def __aenter__(self) -> 'KaspiAPIClient':
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+    
+    async def aclose(self):
+        """Закрыть HTTP клиент и освободить соединения"""
+        await self._client.aclose()
+    
+    async def _get(self, url: str, attempts: int = RETRY_ATTEMPTS, **kwargs) -> httpx.Response:
+        """
+        GET запрос с повторами при временных ошибках
+        
+        Таймауты, ошибки соединения и ответы RETRY_STATUS_CODES повторяются с
+        экспоненциальной паузой (для 429 и 503 - не меньше Retry-After). После
+        CIRCUIT_FAILURE_THRESHOLD неудач подряд запросы этого вида (см. _endpoint) на
+        CIRCUIT_OPEN_SECONDS секунд сразу завершаются KaspiUnavailableError.
+        
+        Args:
+            url: Путь относительно base_url
+            attempts: Всего попыток (1 - без повторов)
+            **kwargs: Параметры httpx (params и т.д.)
+        
+        Returns:
+            Успешный ответ
+        
+        Raises:
+            KaspiUnavailableError: Запросы этого вида недоступны после серии ошибок
+            httpx.HTTPStatusError: Ответ с ошибкой
+            httpx.TransportError: Ошибка соединения или таймаут после всех повторов
+        """
+        endpoint = _endpoint(url)
+        if time.monotonic() < self._circuit_open_until.get(endpoint, 0.0):
+            raise KaspiUnavailableError(f"Kaspi API недоступен ({endpoint}), запросы временно не отправляются")
+        
+        for attempt in range(1, attempts + 1):
+            retry_after = None
+            try:
+                response = await self._client.get(url, **kwargs)
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRY_STATUS_CODES:
+                    # Сервер отвечает - ошибка относится к запросу, а не к доступности API
+                    self._failures.pop(endpoint, None)
+                    raise
+                error, reason = e, f"HTTP {e.response.status_code}"
+                if e.response.status_code in RETRY_AFTER_STATUS_CODES:
+                    retry_after = _retry_after(e.response)
+            except httpx.TransportError as e:
+                error, reason = e, f"{type(e).__name__}: {e}"
+            else:
+                self._failures.pop(endpoint, None)
+                return response
+            
+            if attempt == attempts:
+                break
+            
+            delay = min(RETRY_BACKOFF_BASE * 2 ** (attempt - 1), RETRY_BACKOFF_MAX)
+            if retry_after is not None:
+                if retry_after > RETRY_AFTER_MAX:
+                    logger.warning("Kaspi API: %s, Retry-After %.0f с - не повторяем", reason, retry_after)
+                    break
+                delay = max(delay, retry_after)
+            logger.warning("Kaspi API: %s, повтор %d/%d через %.1f с", reason, attempt, attempts - 1, delay)
+            await asyncio.sleep(delay)
+        
+        failures = self._failures.get(endpoint, 0) + 1
+        self._failures[endpoint] = failures
+        if failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self._circuit_open_until[endpoint] = time.monotonic() + CIRCUIT_OPEN_SECONDS
+            logger.error(
+                "Kaspi API не отвечает на %s (%d неудачных запросов подряд), пауза %.0f с",
+                endpoint, failures, CIRCUIT_OPEN_SECONDS
+            )
+        raise error
     
     async def get_orders(
         self,
@@ -49,16 +239,7 @@ class KaspiAPIClient:
         Returns:
             Словарь с данными о заказах
         """
-        from datetime import datetime, timedelta
-        
-        # Если дата не указана, берем заказы за последние 14 дней (максимум для Kaspi API)
-        if creation_date_from is None:
-            days_ago = datetime.now() - timedelta(days=14)
-            creation_date_from = int(days_ago.timestamp() * 1000)
-        
-        # Верхняя граница - текущее время
-        if creation_date_to is None:
-            creation_date_to = int(datetime.now().timestamp() * 1000)
+        creation_date_from, creation_date_to = self._resolve_period(creation_date_from, creation_date_to)
         
         params = {
             'page[number]': page_number,
@@ -73,43 +254,133 @@ class KaspiAPIClient:
         if state:
             params['filter[orders][state]'] = ','.join(state)
         
-        url = f"{self.base_url}/orders"
+        url = ORDERS_PATH
         
-        logger.info(f"Запрос к API: {url}")
-        logger.info(f"Параметры: {params}")
-        logger.info(f"Период: последние 14 дней")
+        logger.info("Запрос к API: %s%s", self.base_url, url)
+        logger.info("Параметры: %s", params)
+        logger.info("Период: последние 14 дней")
         
         try:
-            async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-                response = await client.get(
-                    url,
-                    headers=self.headers,
-                    params=params
-                )
-                
-                logger.info(f"Статус ответа: {response.status_code}")
-                
-                response.raise_for_status()
-                
-                data = response.json()
-                logger.info(f"Получено заказов: {len(data.get('data', []))}")
-                logger.info(f"Всего заказов (meta): {data.get('meta', {}).get('totalCount', 'N/A')}")
-                
-                return data
+            response = await self._get(
+                url,
+                params=params
+            )
+            
+            logger.info("Статус ответа: %s", response.status_code)
+            logger.debug("Сжатие ответа: %s", response.headers.get('content-encoding', 'нет'))
+            
+            response.raise_for_status()
+            
+            # Страница до 100 заказов с вложенными атрибутами - разбираем быстрым orjson
+            data = orjson.loads(response.content)
+            logger.info("Получено заказов: %s", len(data.get('data', [])))
+            logger.info("Всего заказов (meta): %s", data.get('meta', {}).get('totalCount', 'N/A'))
+            
+            return data
                 
         except httpx.HTTPStatusError as e:
-            logger.error(f"❌ Ошибка HTTP при получении заказов: {e.response.status_code}")
-            logger.error(f"URL: {e.request.url}")
-            logger.error(f"Заголовки запроса: {dict(e.request.headers)}")
-            logger.error(f"Тело ответа: {e.response.text[:500]}")  # Первые 500 символов
+            logger.error("❌ Ошибка HTTP при получении заказов: %s", e.response.status_code)
+            logger.error("URL: %s", e.request.url)
+            # Копия заголовков нужна только для лога - собираем её, если ERROR включён
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error("Заголовки запроса: %s", dict(e.request.headers))
+            logger.error("Тело ответа: %s", e.response.text[:500])  # Первые 500 символов
             raise
         except httpx.TimeoutException as e:
-            logger.error(f"❌ Таймаут при запросе к API: {e}")
+            logger.error("❌ Таймаут при запросе к API: %s", e)
             raise
         except Exception as e:
-            logger.error(f"❌ Неожиданная ошибка при получении заказов: {type(e).__name__}: {e}")
+            logger.error("❌ Неожиданная ошибка при получении заказов: %s: %s", type(e).__name__, e)
             raise
     
+    async def get_all_orders(
+        self,
+        status: Optional[List[str]] = None,
+        state: Optional[List[str]] = None,
+        page_size: int = 100,
+        creation_date_from: Optional[int] = None,
+        creation_date_to: Optional[int] = None,
+        max_concurrency: int = 10
+    ) -> Dict:
+        """
+        Получить заказы со всех страниц
+        
+        Первая страница запрашивается отдельно, из meta.pageCount (или meta.totalCount)
+        определяется количество страниц, остальные страницы запрашиваются параллельно
+        
+        Args:
+            status: Статусы заказов
+            state: Состояния заказов
+            page_size: Количество заказов на странице (макс 100)
+            creation_date_from: Начальная дата создания заказа в миллисекундах
+            creation_date_to: Конечная дата создания заказа в миллисекундах
+            max_concurrency: Максимум одновременных запросов страниц
+        
+        Returns:
+            Словарь в формате ответа get_orders с заказами всех страниц
+        """
+        # Фиксируем период заранее, чтобы все страницы запрашивались с одинаковыми границами
+        creation_date_from, creation_date_to = self._resolve_period(creation_date_from, creation_date_to)
+        
+        filters = {
+            'status': status,
+            'state': state,
+            'page_size': page_size,
+            'creation_date_from': creation_date_from,
+            'creation_date_to': creation_date_to
+        }
+        
+        first_page = await self.get_orders(page_number=0, **filters)
+        meta = first_page.get('meta', {})
+        page_count = meta.get('pageCount')
+        if page_count is None:
+            # pageCount в ответе может не быть - считаем по общему количеству заказов
+            page_count = math.ceil(meta.get('totalCount', 0) / min(page_size, 100))
+        
+        if page_count <= 1:
+            return first_page
+        
+        logger.info("Заказы на %s страницах, запрашиваю остальные параллельно", page_count)
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def fetch_page(page_number: int) -> Dict:
+            async with semaphore:
+                return await self.get_orders(page_number=page_number, **filters)
+        
+        pages = await asyncio.gather(*(fetch_page(number) for number in range(1, page_count)))
+        
+        orders = list(first_page.get('data', []))
+        for page in pages:
+            orders.extend(page.get('data', []))
+        
+        return {**first_page, 'data': orders}
+    
+    @staticmethod
+    def _resolve_period(creation_date_from: Optional[int], creation_date_to: Optional[int]) -> Tuple[int, int]:
+        """
+        Подставить период по умолчанию для запроса заказов
+        
+        Args:
+            creation_date_from: Начальная дата в миллисекундах или None
+            creation_date_to: Конечная дата в миллисекундах или None
+        
+        Returns:
+            Кортеж (начальная дата, конечная дата) в миллисекундах
+        """
+        # Текущее время берем один раз для обеих границ
+        now_ms = int(time.time() * 1000)
+        
+        # Если дата не указана, берем заказы за последние 14 дней (максимум для Kaspi API)
+        if creation_date_from is None:
+            creation_date_from = now_ms - ORDERS_PERIOD_MS
+        
+        # Верхняя граница - текущее время
+        if creation_date_to is None:
+            creation_date_to = now_ms
+        
+        return creation_date_from, creation_date_to
+    
     async def get_order_by_code(self, order_code: str) -> Dict:
         """
         Получить информацию о заказе по его коду
@@ -125,38 +396,35 @@ class KaspiAPIClient:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-                response = await client.get(
-                    f"{self.base_url}/orders",
-                    headers=self.headers,
-                    params=params
-                )
-                response.raise_for_status()
-                return response.json()
+            response = await self._get(
+                ORDERS_PATH,
+                params=params
+            )
+            response.raise_for_status()
+            return orjson.loads(response.content)
         except Exception as e:
-            logger.error(f"Ошибка при получении заказа {order_code}: {e}")
+            logger.error("Ошибка при получении заказа %s: %s", order_code, e)
             raise
     
-    async def get_order_by_id(self, order_id: str) -> Dict:
+    async def get_order_by_id(self, order_id: str, retry: bool = True) -> Dict:
         """
         Получить информацию о заказе по его ID
         
         Args:
             order_id: ID заказа
+            retry: Повторять ли запрос при временных ошибках (False - одна попытка,
+                без объединения с одновременными запросами этого заказа)
         
         Returns:
             Словарь с данными о заказе
         """
+        url = f"/orders/{order_id}"
         try:
-            async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-                response = await client.get(
-                    f"{self.base_url}/orders/{order_id}",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                return response.json()
+            if not retry:
+                return await self._get_json(url, attempts=1)
+            return await self._get_json_shared(url)
         except Exception as e:
-            logger.error(f"Ошибка при получении заказа по ID {order_id}: {e}")
+            logger.error("Ошибка при получении заказа по ID %s: %s", order_id, e)
             raise
     
     async def get_order_items(self, order_id: str) -> Dict:
@@ -170,21 +438,43 @@ class KaspiAPIClient:
             Словарь с данными о товарах
         """
         try:
-            async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-                response = await client.get(
-                    f"{self.base_url}/orders/{order_id}/entries",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                return response.json()
+            return await self._get_json_shared(f"/orders/{order_id}/entries")
         except Exception as e:
-            logger.error(f"Ошибка при получении товаров заказа {order_id}: {e}")
+            logger.error("Ошибка при получении товаров заказа %s: %s", order_id, e)
             raise
     
+    async def _get_json_shared(self, url: str) -> Dict:
+        """
+        GET запрос с разбором JSON, один на всех одновременных вызывающих
+        
+        Пока запрос к этому пути выполняется, новые вызовы ждут его ответ, а не отправляют
+        свой (отмена одного ожидающего не отменяет запрос)
+        
+        Args:
+            url: Путь относительно base_url
+        
+        Returns:
+            Ответ API (общий для вызывающих - не изменять)
+        """
+        future = self._inflight.get(url)
+        if future is None:
+            future = asyncio.ensure_future(self._get_json(url))
+            self._inflight[url] = future
+            future.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return await asyncio.shield(future)
+    
+    async def _get_json(self, url: str, attempts: int = RETRY_ATTEMPTS) -> Dict:
+        """GET запрос с разбором JSON ответа"""
+        response = await self._get(url, attempts=attempts)
+        return orjson.loads(response.content)
+    
     async def get_product_description(self, entry_id: str) -> Dict:
         """
         Получить описание товара по ID позиции заказа
         
+        Ответ кэшируется на PRODUCT_CACHE_TTL, отсутствие описания (404) -
+        на PRODUCT_NOT_FOUND_CACHE_TTL
+        
         Args:
             entry_id: ID позиции заказа
         
@@ -192,25 +482,30 @@ class KaspiAPIClient:
             Словарь с данными о товаре (code, name, manufacturer, category)
         """
         try:
-            async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-                response = await client.get(
-                    f"{self.base_url}/orderentries/{entry_id}/product",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                return response.json()
+            return await self._get_cached(
+                self._product_cache, entry_id, lambda: self._fetch_product_description(entry_id),
+                ttl=PRODUCT_CACHE_TTL, size=PRODUCT_CACHE_SIZE, empty_ttl=PRODUCT_NOT_FOUND_CACHE_TTL
+            )
         except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                logger.debug(f"Описание товара недоступно для {entry_id} (404)")
-            else:
-                logger.warning(f"Ошибка {e.response.status_code} при получении описания товара для {entry_id}")
+            logger.warning("Ошибка %s при получении описания товара для %s", e.response.status_code, entry_id)
             # Возвращаем пустой результат вместо ошибки
             return {'data': {'attributes': {}}}
         except Exception as e:
-            logger.warning(f"Не удалось получить описание товара для {entry_id}: {e}")
+            logger.warning("Не удалось получить описание товара для %s: %s", entry_id, e)
             # Возвращаем пустой результат вместо ошибки
             return {'data': {'attributes': {}}}
     
+    async def _fetch_product_description(self, entry_id: str) -> Dict:
+        """Запросить описание товара позиции заказа (без кэша, 404 - пустой результат)"""
+        try:
+            response = await self._get(f"/orderentries/{entry_id}/product")
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise
+            logger.debug("Описание товара недоступно для %s (404)", entry_id)
+            return {'data': {'attributes': {}}}
+        return orjson.loads(response.content)
+    
     async def get_order_entry_details(self, entry_id: str) -> Dict:
         """
         Получить детальную информацию о товаре в заказе
@@ -223,20 +518,61 @@ class KaspiAPIClient:
             Словарь с детальными данными о товаре
         """
         try:
-            async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-                response = await client.get(
-                    f"{self.base_url}/orderentries/{entry_id}",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                return response.json()
+            response = await self._get(f"/orderentries/{entry_id}")
+            response.raise_for_status()
+            return orjson.loads(response.content)
         except Exception as e:
-            logger.warning(f"Не удалось получить детали товара для {entry_id}: {e}")
+            logger.warning("Не удалось получить детали товара для %s: %s", entry_id, e)
             return {'data': {'attributes': {}}}
     
+    async def _get_cached(self, cache: OrderedDict, key: str, fetch: Callable[[], Awaitable[Dict]],
+                          ttl: float = WAREHOUSE_CACHE_TTL, size: int = WAREHOUSE_CACHE_SIZE,
+                          empty_ttl: Optional[float] = None) -> Dict:
+        """
+        Получить ответ из кэша или запросить его
+        
+        Одновременные запросы одного ключа ждут один HTTP запрос, ошибки не кэшируются
+        
+        Args:
+            cache: Кэш (срок действия, Future) с вытеснением самых старых записей
+            key: Ключ запроса
+            fetch: Функция, создающая корутину запроса
+            ttl: Сколько секунд хранить ответ
+            size: Максимум записей в кэше
+            empty_ttl: Сколько секунд хранить ответ без data.attributes (None - как ttl)
+        
+        Returns:
+            Ответ API (общий для вызывающих - не изменять)
+        """
+        now = time.monotonic()
+        entry = cache.get(key)
+        if entry is not None and entry[0] > now:
+            cache.move_to_end(key)
+            return await asyncio.shield(entry[1])
+        
+        future = asyncio.ensure_future(fetch())
+        entry = (now + ttl, future)
+        cache[key] = entry
+        cache.move_to_end(key)
+        while len(cache) > size:
+            cache.popitem(last=False)
+        
+        def on_done(_):
+            # Запись обновляется при завершении запроса, даже если все ожидающие
+            # уже отменены - иначе ошибка осталась бы в кэше на весь ttl
+            if cache.get(key) is not entry:
+                return
+            if future.cancelled() or future.exception() is not None:
+                del cache[key]
+            elif empty_ttl is not None and not future.result().get('data', {}).get('attributes'):
+                cache[key] = (now + empty_ttl, future)
+        
+        future.add_done_callback(on_done)
+        return await asyncio.shield(future)
+    
     async def get_delivery_point(self, entry_id: str) -> Dict:
         """
-        Получить информацию о складе отправки
+        Получить информацию о складе отправки (ответ кэшируется на WAREHOUSE_CACHE_TTL)
         
         Args:
             entry_id: ID позиции заказа
@@ -244,21 +580,23 @@ class KaspiAPIClient:
         Returns:
             Словарь с данными о складе
         """
+        return await self._get_cached(
+            self._delivery_point_cache, entry_id, lambda: self._fetch_delivery_point(entry_id)
+        )
+    
+    async def _fetch_delivery_point(self, entry_id: str) -> Dict:
+        """Запросить склад отправки позиции заказа (без кэша)"""
         try:
-            async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-                response = await client.get(
-                    f"{self.base_url}/orderentries/{entry_id}/deliveryPointOfService",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                return response.json()
+            response = await self._get(f"/orderentries/{entry_id}/deliveryPointOfService")
+            response.raise_for_status()
+            return orjson.loads(response.content)
         except Exception as e:
-            logger.error(f"Ошибка при получении склада для {entry_id}: {e}")
+            logger.error("Ошибка при получении склада для %s: %s", entry_id, e)
             raise
     
     async def get_point_of_service(self, point_id: str) -> Dict:
         """
-        Получить информацию о складе по ID
+        Получить информацию о складе по ID (ответ кэшируется на WAREHOUSE_CACHE_TTL)
         
         Args:
             point_id: ID склада
@@ -266,16 +604,18 @@ class KaspiAPIClient:
         Returns:
             Словарь с данными о складе
         """
+        return await self._get_cached(
+            self._point_of_service_cache, point_id, lambda: self._fetch_point_of_service(point_id)
+        )
+    
+    async def _fetch_point_of_service(self, point_id: str) -> Dict:
+        """Запросить склад по ID (без кэша)"""
         try:
-            async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-                response = await client.get(
-                    f"{self.base_url}/pointofservices/{point_id}",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                return response.json()
+            response = await self._get(f"/pointofservices/{point_id}")
+            response.raise_for_status()
+            return orjson.loads(response.content)
         except Exception as e:
-            logger.error(f"Ошибка при получении информации о складе {point_id}: {e}")
+            logger.error("Ошибка при получении информации о складе %s: %s", point_id, e)
             raise
     
     async def accept_order(self, order_id: str, order_code: str) -> Dict:
@@ -301,17 +641,15 @@ class KaspiAPIClient:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-                response = await client.post(
-                    f"{self.base_url}/orders",
-                    headers=self.headers,
-                    json=payload
-                )
-                response.raise_for_status()
-                logger.info(f"Заказ {order_code} принят успешно")
-                return response.json()
+            response = await self._client.post(
+                ORDERS_PATH,
+                content=orjson.dumps(payload)
+            )
+            response.raise_for_status()
+            logger.info("Заказ %s принят успешно", order_code)
+            return orjson.loads(response.content)
         except Exception as e:
-            logger.error(f"Ошибка при принятии заказа {order_id}: {e}")
+            logger.error("Ошибка при принятии заказа %s: %s", order_id, e)
             raise
 
     async def change_order_status(self, order_code: str, status: str, number_of_space: int = 1) -> Dict:
@@ -337,30 +675,28 @@ class KaspiAPIClient:
             }
         }
         
-        url = f"{self.base_url}/orders"
+        url = ORDERS_PATH
         
-        logger.info(f"=== ИЗМЕНЕНИЕ СТАТУСА ЗАКАЗА ===")
-        logger.info(f"Order Code: {order_code}")
-        logger.info(f"Новый статус: {status}")
-        logger.info(f"Payload: {payload}")
+        logger.info("=== ИЗМЕНЕНИЕ СТАТУСА ЗАКАЗА ===")
+        logger.info("Order Code: %s", order_code)
+        logger.info("Новый статус: %s", status)
+        logger.info("Payload: %s", payload)
         
         try:
-            async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-                response = await client.post(
-                    url,
-                    headers=self.headers,
-                    json=payload
-                )
-                
-                logger.info(f"Response Status: {response.status_code}")
-                response.raise_for_status()
-                logger.info(f"✅ Статус заказа {order_code} изменен на {status}")
-                return response.json()
+            response = await self._client.post(
+                url,
+                content=orjson.dumps(payload)
+            )
+            
+            logger.info("Response Status: %s", response.status_code)
+            response.raise_for_status()
+            logger.info("✅ Статус заказа %s изменен на %s", order_code, status)
+            return orjson.loads(response.content)
                 
         except httpx.HTTPStatusError as e:
-            logger.error(f"❌ HTTP Error {e.response.status_code}")
-            logger.error(f"Response: {e.response.text}")
+            logger.error("❌ HTTP Error %s", e.response.status_code)
+            logger.error("Response: %s", e.response.text)
             raise
         except Exception as e:
-            logger.error(f"❌ Error: {type(e).__name__}: {e}")
+            logger.error("❌ Error: %s: %s", type(e).__name__, e)
             raise
\ No newline at end of file
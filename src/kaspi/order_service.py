@@ -1,15 +1,85 @@
 """
 Сервис для обработки заказов Kaspi
 """
+import asyncio
+import base64
 import logging
+import time
 import httpx
 from datetime import datetime
-from typing import List, Dict, Optional
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Awaitable, Callable, List, Dict, Optional, Set, Tuple
 from src.kaspi.api_client import KaspiAPIClient
 from src.database.models import Database
+from src.log_utils import ErrorOnceLogger
 
 logger = logging.getLogger(__name__)
 
+# Статусы завершенных заказов
+FINISHED_STATUSES = frozenset(('COMPLETED', 'CANCELLED', 'CANCELLING'))
+
+# Описание типа доставки по (deliveryMode, isKaspiDelivery) согласно документации Kaspi
+DELIVERY_TYPES = MappingProxyType({
+    ('DELIVERY_LOCAL', True): 'Kaspi Доставка (по городу)',
+    ('DELIVERY_LOCAL', False): 'Доставка по городу (своими силами)',
+    ('DELIVERY_PICKUP', True): 'Kaspi Postomat',
+    ('DELIVERY_PICKUP', False): 'Самовывоз',
+    ('DELIVERY_REGIONAL_TODOOR', True): 'Kaspi Доставка (по области)',
+    ('DELIVERY_REGIONAL_TODOOR', False): 'Доставка по области',
+    ('DELIVERY_REGIONAL_PICKUP', True): '🏪 Самовывоз (доставка по области до склада)',
+    ('DELIVERY_REGIONAL_PICKUP', False): '🏪 Самовывоз (доставка по области до склада)',
+})
+
+# Максимум одновременных запросов к Kaspi при загрузке данных новых заказов
+KASPI_CONCURRENCY = 10
+
+# Сколько секунд переиспользовать результат проверки статуса заказа (двойные нажатия кнопок)
+ORDER_STATUS_CACHE_TTL = 5.0
+
+# Через сколько секунд перечитывать из БД множество обработанных заказов
+# (чтобы увидеть отметки, сделанные другим процессом)
+NOTIFIED_CODES_REFRESH_INTERVAL = 600.0
+
+# Поля полной информации о заказе, которые записываются в БД (обязательные и
+# необязательные со значением по умолчанию), см. _order_data
+ORDER_DB_FIELDS = (
+    'id', 'code', 'status', 'state', 'total_price', 'customer_name', 'customer_phone',
+    'delivery_mode', 'delivery_address', 'warehouse_id', 'warehouse_name', 'warehouse_address',
+    'planned_delivery_date', 'is_kaspi_delivery'
+)
+ORDER_DB_OPTIONAL_FIELDS = MappingProxyType({
+    'is_express': False,
+    'waybill_url': '',
+    'waybill_pdf_data': None,
+    'items': None,
+})
+
+# Ожидание URL накладной после перевода заказа в ASSEMBLE: заказ перезапрашивается
+# (одна попытка на запрос, без повторов) с паузами WAYBILL_POLL_DELAY, 2x, 4x...
+# (не больше WAYBILL_POLL_MAX_DELAY), пока не пройдет WAYBILL_POLL_TIMEOUT секунд -
+# вместе с запросами, которые обрываются по истечении этого времени
+WAYBILL_POLL_TIMEOUT = 5.0
+WAYBILL_POLL_DELAY = 0.2
+WAYBILL_POLL_MAX_DELAY = 1.0
+
+# Размер части при потоковом чтении PDF накладной
+WAYBILL_CHUNK_SIZE = 64 * 1024
+
+# Заголовки для скачивания PDF накладных (токен авторизации добавляется при создании клиента)
+WAYBILL_PDF_HEADERS = MappingProxyType({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'application/pdf,*/*',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8'
+})
+
+
+@lru_cache(maxsize=2048)
+def _timestamp_to_datetime(timestamp_ms: int) -> datetime:
+    """Timestamp в миллисекундах -> datetime (у заказов одного дня даты доставки совпадают)"""
+    return datetime.fromtimestamp(timestamp_ms / 1000)
+
 
 class OrderService:
     """Сервис для работы с заказами"""
@@ -17,43 +87,127 @@ class OrderService:
     def __init__(self, kaspi_client: KaspiAPIClient, database: Database):
         self.kaspi = kaspi_client
         self.db = database
+        self._errors = ErrorOnceLogger(logger)
+        
+        # Код заказа -> (время проверки, статус), см. check_order_status
+        self._status_cache: Dict[str, Tuple[float, Dict]] = {}
+        
+        # Выполняющиеся запросы к Kaspi: (операция, ключ) -> общий Future, см. _singleflight
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        
+        # Ограничение параллельных запросов к Kaspi при загрузке данных заказов
+        self._kaspi_limit = asyncio.Semaphore(KASPI_CONCURRENCY)
+        
+        # Коды заказов, о которых уже было уведомление, см. _get_notified_codes
+        # (время последней успешной загрузки из БД, None - еще не загружалось)
+        self._notified: Set[str] = set()
+        self._notified_loaded_at: Optional[float] = None
+        
+        # HTTP клиент для скачивания PDF накладных, см. _get_pdf_client
+        self._pdf_client: Optional[httpx.AsyncClient] = None
+    
+    def _get_pdf_client(self) -> httpx.AsyncClient:
+        """
+        HTTP клиент для скачивания накладных (создается при первом обращении)
+        
+        Один клиент на всё время работы (и для загрузки новых заказов, и для бота) -
+        соединения с сервером накладных переиспользуются между загрузками
+        
+        Returns:
+            HTTP клиент
+        """
+        if self._pdf_client is None:
+            self._pdf_client = httpx.AsyncClient(
+                # По HTTP/2 параллельные загрузки накладных идут через одно соединение
+                http2=True,
+                timeout=30.0,
+                follow_redirects=True,
+                # Соединения держим минуту: накладные обычно скачивают сериями
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60.0),
+                # Используем токен авторизации API для скачивания
+                headers={**WAYBILL_PDF_HEADERS, 'X-Auth-Token': self.kaspi.api_token}
+            )
+        return self._pdf_client
+    
+    async def aclose(self):
+        """Закрыть HTTP клиент для скачивания накладных"""
+        if self._pdf_client is not None:
+            await self._pdf_client.aclose()
+            self._pdf_client = None
+    
+    def _singleflight(self, key: tuple, factory: Callable[[], Awaitable]) -> Awaitable:
+        """
+        Выполнить запрос один раз для всех одновременных вызывающих
+        
+        Пока запрос с таким ключом выполняется, новые вызовы ждут его результат,
+        а не отправляют свой
+        
+        Args:
+            key: Ключ запроса, например ('status', код заказа)
+            factory: Функция, создающая корутину запроса
+        
+        Returns:
+            Awaitable с результатом запроса (отмена одного ожидающего не отменяет запрос)
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return asyncio.shield(future)
+    
+    def _get_notified_codes(self) -> Set[str]:
+        """
+        Множество кодов обработанных заказов без запроса к БД на каждый заказ
+        
+        Загружается из БД при первой проверке и раз в NOTIFIED_CODES_REFRESH_INTERVAL
+        секунд, между загрузками пополняется в save_orders_to_db и очищается в clear_database
+        
+        Returns:
+            Множество кодов обработанных заказов
+        
+        Raises:
+            Exception: Если загрузить множество из БД не удалось - с пустым или
+                устаревшим множеством о старых заказах уведомили бы повторно
+        """
+        now = time.monotonic()
+        if self._notified_loaded_at is None or now - self._notified_loaded_at >= NOTIFIED_CODES_REFRESH_INTERVAL:
+            self._notified = self.db.get_all_notified_codes()
+            self._notified_loaded_at = now
+        return self._notified
     
     def _format_timestamp(self, timestamp_ms: Optional[int]) -> Optional[datetime]:
         """Конвертировать timestamp в миллисекундах в datetime"""
         if timestamp_ms:
-            return datetime.fromtimestamp(timestamp_ms / 1000)
+            return _timestamp_to_datetime(timestamp_ms)
         return None
     
-    def _get_delivery_type_text(self, delivery_mode: str, is_kaspi_delivery: bool) -> str:
+    @staticmethod
+    def _get_delivery_type_text(delivery_mode: str, is_kaspi_delivery: bool) -> str:
         """Получить текстовое описание типа доставки"""
-        # Определяем тип доставки согласно документации Kaspi
-        if delivery_mode == 'DELIVERY_LOCAL':
-            if is_kaspi_delivery:
-                return 'Kaspi Доставка (по городу)'
-            else:
-                return 'Доставка по городу (своими силами)'
-        
-        elif delivery_mode == 'DELIVERY_PICKUP':
-            if is_kaspi_delivery:
-                return 'Kaspi Postomat'
-            else:
-                return 'Самовывоз'
-        
-        elif delivery_mode == 'DELIVERY_REGIONAL_TODOOR':
-            if is_kaspi_delivery:
-                return 'Kaspi Доставка (по области)'
-            else:
-                return 'Доставка по области'
+        text = DELIVERY_TYPES.get((delivery_mode, bool(is_kaspi_delivery)))
+        if text is None:
+            # Если неизвестный тип
+            return f'📍 {delivery_mode}'
+        return text
+    
+    async def _download_waybill_pdf(self, waybill_url: str) -> Optional[bytes]:
+        """
+        Скачать PDF накладной по URL (одновременные загрузки одного URL объединяются)
         
-        elif delivery_mode == 'DELIVERY_REGIONAL_PICKUP':
-            return '🏪 Самовывоз (доставка по области до склада)'
+        Args:
+            waybill_url: URL накладной
         
-        # Если неизвестный тип
-        return f'📍 {delivery_mode}'
+        Returns:
+            Содержимое PDF как bytes или None при ошибке
+        """
+        return await self._singleflight(
+            ('pdf', waybill_url), lambda: self._fetch_waybill_pdf(waybill_url)
+        )
     
-    async def _download_waybill_pdf(self, waybill_url: str) -> Optional[bytes]:
+    async def _fetch_waybill_pdf(self, waybill_url: str) -> Optional[bytes]:
         """
-        Скачать PDF накладной по URL
+        Скачать PDF накладной (без объединения одновременных вызовов)
         
         Args:
             waybill_url: URL накладной
@@ -62,39 +216,56 @@ class OrderService:
             Содержимое PDF как bytes или None при ошибке
         """
         try:
-            logger.info(f"Скачиваю PDF накладной из {waybill_url}")
-            
-            # Используем те же заголовки что и для API, включая токен авторизации
-            headers = {
-                'X-Auth-Token': self.kaspi.api_token,
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'application/pdf,*/*',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8'
-            }
+            logger.info("Скачиваю PDF накладной из %s", waybill_url)
+            
+            pdf_content = await self.read_waybill_pdf(waybill_url)
+            if pdf_content is not None:
+                logger.info("PDF накладной успешно скачан, размер: %s байт", len(pdf_content))
+            return pdf_content
             
-            async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-                response = await client.get(waybill_url, headers=headers)
-                response.raise_for_status()
-                
-                pdf_content = response.content
-                
-                # Проверяем что это действительно PDF
-                if not pdf_content.startswith(b'%PDF'):
-                    logger.error(f"Полученный файл не является PDF. Первые 100 байт: {pdf_content[:100]}")
-                    return None
-                
-                logger.info(f"PDF накладной успешно скачан, размер: {len(pdf_content)} байт")
-                return pdf_content
-                
         except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP ошибка при скачивании PDF накладной: {e.response.status_code}")
-            logger.error(f"Ответ сервера: {e.response.text[:500]}")
+            logger.error("HTTP ошибка при скачивании PDF накладной: %s", e.response.status_code)
+            logger.error("Ответ сервера: %s", e.response.text[:500])
             return None
         except Exception as e:
-            logger.error(f"Ошибка при скачивании PDF накладной: {type(e).__name__}: {e}")
+            logger.error("Ошибка при скачивании PDF накладной: %s: %s", type(e).__name__, e)
+            return None
+    
+    async def read_waybill_pdf(self, waybill_url: str) -> Optional[bytes]:
+        """
+        Скачать накладную потоком
+        
+        Тело читается частями, а если первые байты не похожи на PDF,
+        загрузка прерывается, не дочитывая ответ
+        
+        Args:
+            waybill_url: URL накладной
+        
+        Returns:
+            Содержимое PDF или None если по ссылке не PDF (в том числе пустой ответ)
+        
+        Raises:
+            httpx.HTTPStatusError: Если сервер вернул ошибку
+        """
+        chunks = []
+        async with self._get_pdf_client().stream("GET", waybill_url) as response:
+            if response.is_error:
+                # Тело ошибки нужно прочитать, чтобы его можно было вывести в лог
+                await response.aread()
+                response.raise_for_status()
+            
+            async for chunk in response.aiter_bytes(WAYBILL_CHUNK_SIZE):
+                # Проверяем что это действительно PDF
+                if not chunks and not chunk.startswith(b'%PDF'):
+                    logger.error("Полученный файл не является PDF. Первые 100 байт: %s", chunk[:100])
+                    return None
+                chunks.append(chunk)
+        
+        if not chunks:
+            logger.error("Сервер вернул пустой ответ вместо PDF накладной")
             return None
+        
+        return b"".join(chunks)
     
     async def get_new_orders(self) -> List[Dict]:
         """
@@ -108,14 +279,14 @@ class OrderService:
             logger.info("Фильтры: status=['APPROVED_BY_BANK', 'ACCEPTED_BY_MERCHANT']")
             logger.info("Это автоматически исключает: COMPLETED, CANCELLED, ARCHIVE")
             
-            response = await self.kaspi.get_orders(
+            response = await self.kaspi.get_all_orders(
                 status=['APPROVED_BY_BANK', 'ACCEPTED_BY_MERCHANT']
             )
             
             orders_data = response.get('data', [])
             total_count = response.get('meta', {}).get('totalCount', 0)
             
-            logger.info(f"📊 Получено заказов из API: {len(orders_data)} (всего в системе: {total_count})")
+            logger.info("📊 Получено заказов из API: %s (всего в системе: %s)", len(orders_data), total_count)
             
             if not orders_data:
                 logger.info("ℹ️  Заказов с указанными фильтрами не найдено")
@@ -125,47 +296,74 @@ class OrderService:
                 logger.info("   - Проверьте статусы заказов в личном кабинете Kaspi")
                 return []
             
-            new_orders = []
+            # Уже обработанные заказы проверяем по множеству в памяти
+            # (периодическая перезагрузка из БД - в отдельном потоке;
+            # если БД недоступна, проверка пропускается целиком)
+            notified_codes = await asyncio.to_thread(self._get_notified_codes)
+            unnotified = [order for order in orders_data if order['attributes']['code'] not in notified_codes]
+            
+            # Обычно все заказы уже обработаны - тогда поштучный разбор не нужен
+            if not unnotified:
+                logger.info("⏭️  Все %d заказов уже обработаны ранее", len(orders_data))
+                return []
             
-            for idx, order in enumerate(orders_data, 1):
+            logger.info("Пропускаем уже обработанных заказов: %d", len(orders_data) - len(unnotified))
+            
+            # Заказы, для которых нужно загрузить полную информацию: (заказ, завершен ли)
+            pending = []
+            
+            for idx, order in enumerate(unnotified, 1):
                 order_code = order['attributes']['code']
                 order_status = order['attributes']['status']
                 order_state = order['attributes']['state']
                 
-                logger.info(f"  [{idx}/{len(orders_data)}] Заказ #{order_code} - статус: {order_status}, состояние: {order_state}")
-                
-                # Проверяем, отправляли ли уже уведомление
-                if self.db.is_order_notified(order_code):
-                    logger.info(f"    ⏭️  Пропускаем - уже обработан ранее")
-                    continue
+                logger.info("  [%d/%d] Заказ #%s - статус: %s, состояние: %s",
+                            idx, len(unnotified), order_code, order_status, order_state)
                 
                 # Определяем завершен ли заказ
-                is_completed = order_status in ['COMPLETED', 'CANCELLED', 'CANCELLING'] or order_state == 'ARCHIVE'
-                
-                # Получаем полную информацию о заказе
-                logger.info(f"    ✅ Получаем информацию о заказе...")
-                order_info = await self._get_full_order_info(order)
+                is_completed = order_status in FINISHED_STATUSES or order_state == 'ARCHIVE'
                 
+                logger.info("    ✅ Получаем информацию о заказе...")
+                pending.append((order, is_completed))
+            
+            # Полную информацию о заказах загружаем параллельно
+            # (число одновременных запросов к Kaspi ограничено _kaspi_limit)
+            order_infos = await asyncio.gather(
+                *(self._get_full_order_info(order) for order, _ in pending)
+            )
+            
+            loaded = []
+            
+            for (order, is_completed), order_info in zip(pending, order_infos):
                 if not order_info:
-                    logger.warning(f"    ⚠️  Не удалось получить полную информацию")
+                    logger.warning("    ⚠️  Заказ #%s: не удалось получить полную информацию",
+                                   order['attributes']['code'])
                     continue
-                
-                # Сохраняем ВСЕ заказы в БД
-                self.save_order_to_db(order_info)
-                self.mark_order_notified(order_code)
+                loaded.append((order_info, is_completed))
+            
+            # Сохраняем ВСЕ заказы в БД одной транзакцией (в отдельном потоке,
+            # чтобы запись не блокировала event loop). Если запись не удалась,
+            # уведомления не отправляем - заказы будут обработаны при следующей проверке
+            if loaded:
+                await asyncio.to_thread(self.save_orders_to_db, [order_info for order_info, _ in loaded])
+            
+            new_orders = []
+            
+            for order_info, is_completed in loaded:
+                order_code = order_info['code']
                 
                 # Но в список для УВЕДОМЛЕНИЙ добавляем только активные
                 if is_completed:
-                    logger.info(f"    📝 Сохранен в БД без уведомления - заказ завершен")
+                    logger.info("    📝 Заказ #%s сохранен в БД без уведомления - заказ завершен", order_code)
                 else:
-                    logger.info(f"    ✓ Сохранен в БД, будет отправлено уведомление")
+                    logger.info("    ✓ Заказ #%s сохранен в БД, будет отправлено уведомление", order_code)
                     new_orders.append(order_info)
             
-            logger.info(f"🎯 Итого новых заказов для обработки: {len(new_orders)}")
+            logger.info("🎯 Итого новых заказов для обработки: %s", len(new_orders))
             return new_orders
             
         except Exception as e:
-            logger.error(f"❌ Ошибка при получении новых заказов: {type(e).__name__}: {e}", exc_info=True)
+            self._errors.error("❌ Ошибка при получении новых заказов", e)
             return []
     
     async def _get_full_order_info(self, order: Dict) -> Optional[Dict]:
@@ -182,70 +380,45 @@ class OrderService:
             order_id = order['id']
             attributes = order['attributes']
             
-            # Получаем товары
-            items_response = await self.kaspi.get_order_items(order_id)
-            items_data = items_response.get('data', [])
-            
-            # Формируем список товаров
-            items = []
-            warehouse_info = None
-            
-            for item in items_data:
-                item_attrs = item['attributes']
-                
-                # Получаем описание товара через правильный endpoint
-                product_description = ""
-                try:
-                    product_info = await self.kaspi.get_product_description(item['id'])
-                    product_attrs = product_info.get('data', {}).get('attributes', {})
-                    
-                    # Формируем описание из product endpoint
-                    desc_parts = []
-                    
-                    # Название товара
-                    if product_attrs.get('name'):
-                        desc_parts.append(product_attrs['name'])
-                    
-                    # Бренд
-                    if product_attrs.get('manufacturer'):
-                        desc_parts.append(f"Бренд: {product_attrs['manufacturer']}")
-                    
-                    # Код товара в Kaspi (БЕЗ префикса "Код:")
-                    if product_attrs.get('code'):
-                        desc_parts.append(product_attrs['code'])
-                    
-                    product_description = " | ".join(desc_parts) if desc_parts else ""
-                    
-                except Exception as e:
-                    logger.debug(f"Описание товара недоступно: {e}")
-                    product_description = ""
+            # URL накладной известен из списка заказов - PDF начинаем скачивать сразу,
+            # параллельно с загрузкой товаров
+            waybill_url = attributes.get('waybill', '')
+            waybill_task = asyncio.ensure_future(self._download_waybill_pdf(waybill_url)) if waybill_url else None
+            warehouse_task = None
+            
+            try:
+                # Получаем товары
+                async with self._kaspi_limit:
+                    items_response = await self.kaspi.get_order_items(order_id)
+                items_data = items_response.get('data', [])
                 
-                # Получаем информацию о складе для первого товара
-                if warehouse_info is None:
-                    try:
-                        warehouse_response = await self.kaspi.get_delivery_point(item['id'])
-                        warehouse_data = warehouse_response.get('data', {})
-                        warehouse_attrs = warehouse_data.get('attributes', {})
-                        warehouse_info = {
-                            'id': warehouse_data.get('id', ''),
-                            'name': warehouse_attrs.get('displayName', 'Не указан'),
-                            'address': warehouse_attrs.get('address', {}).get('formattedAddress', 'Адрес не указан')
-                        }
-                    except Exception as e:
-                        logger.warning(f"Не удалось получить информацию о складе: {e}")
-                        warehouse_info = {
-                            'id': '',
-                            'name': 'Не указан',
-                            'address': 'Адрес не указан'
-                        }
+                # Склад (по первому товару) загружаем параллельно с описаниями товаров
+                warehouse_task = (
+                    asyncio.ensure_future(self._get_warehouse_info(items_data[0]['id'])) if items_data else None
+                )
                 
-                items.append({
-                    'name': item_attrs.get('category', {}).get('title', 'Товар'),
-                    'description': product_description,
-                    'quantity': item_attrs.get('quantity', 1),
-                    'price': item_attrs.get('basePrice', 0),
-                    'total_price': item_attrs.get('totalPrice', 0)
-                })
+                descriptions = await asyncio.gather(
+                    *(self._get_product_description(item['id']) for item in items_data)
+                )
+                warehouse_info = await warehouse_task if warehouse_task else None
+                waybill_pdf_data = await waybill_task if waybill_task else None
+            finally:
+                # При ошибке или отмене не оставляем фоновые задачи без присмотра
+                for task in (waybill_task, warehouse_task):
+                    if task is not None and not task.done():
+                        task.cancel()
+            
+            # Формируем список товаров
+            items = [
+                {
+                    'name': item['attributes'].get('category', {}).get('title', 'Товар'),
+                    'description': description,
+                    'quantity': item['attributes'].get('quantity', 1),
+                    'price': item['attributes'].get('basePrice', 0),
+                    'total_price': item['attributes'].get('totalPrice', 0)
+                }
+                for item, description in zip(items_data, descriptions)
+            ]
             
             # Формируем полную информацию о заказе
             customer = attributes.get('customer', {})
@@ -254,14 +427,6 @@ class OrderService:
             # Проверяем экспресс-доставку
             is_express = attributes.get('express', False)
             
-            # Получаем URL накладной
-            waybill_url = attributes.get('waybill', '')
-            
-            # Скачиваем PDF накладной если есть URL
-            waybill_pdf_data = None
-            if waybill_url:
-                waybill_pdf_data = await self._download_waybill_pdf(waybill_url)
-            
             order_info = {
                 'id': order_id,
                 'code': attributes['code'],
@@ -291,46 +456,97 @@ class OrderService:
             return order_info
             
         except Exception as e:
-            logger.error(f"Ошибка при получении полной информации о заказе: {e}")
+            logger.error("Ошибка при получении полной информации о заказе: %s", e)
             return None
     
-    def save_order_to_db(self, order_info: Dict):
-        """Сохранить заказ в базу данных"""
+    async def _get_product_description(self, entry_id: str) -> str:
+        """
+        Описание товара: название, бренд и код товара в Kaspi через " | "
+        
+        Args:
+            entry_id: ID позиции заказа
+        
+        Returns:
+            Описание товара или пустая строка, если оно недоступно
+        """
         try:
-            order_data = {
-                'id': order_info['id'],
-                'code': order_info['code'],
-                'status': order_info['status'],
-                'state': order_info['state'],
-                'total_price': order_info['total_price'],
-                'customer_name': order_info['customer_name'],
-                'customer_phone': order_info['customer_phone'],
-                'delivery_mode': order_info['delivery_mode'],
-                'delivery_address': order_info['delivery_address'],
-                'warehouse_id': order_info['warehouse_id'],
-                'warehouse_name': order_info['warehouse_name'],
-                'warehouse_address': order_info['warehouse_address'],
-                'planned_delivery_date': order_info['planned_delivery_date'],
-                'is_kaspi_delivery': order_info['is_kaspi_delivery'],
-                'is_express': order_info.get('is_express', False),
-                'waybill_url': order_info.get('waybill_url', ''),
-                'waybill_pdf_data': order_info.get('waybill_pdf_data'),  # Добавляем PDF данные
-                'items': order_info.get('items', [])
-            }
+            async with self._kaspi_limit:
+                product_info = await self.kaspi.get_product_description(entry_id)
+            product_attrs = product_info.get('data', {}).get('attributes', {})
+            
+            # Формируем описание из product endpoint
+            desc_parts = []
             
-            self.db.save_order(order_data)
-            logger.info(f"Заказ {order_info['code']} сохранен в БД")
+            # Название товара
+            if product_attrs.get('name'):
+                desc_parts.append(product_attrs['name'])
+            
+            # Бренд
+            if product_attrs.get('manufacturer'):
+                desc_parts.append(f"Бренд: {product_attrs['manufacturer']}")
+            
+            # Код товара в Kaspi (БЕЗ префикса "Код:")
+            if product_attrs.get('code'):
+                desc_parts.append(product_attrs['code'])
+            
+            return " | ".join(desc_parts)
             
         except Exception as e:
-            logger.error(f"Ошибка при сохранении заказа в БД: {e}")
+            logger.debug("Описание товара недоступно: %s", e)
+            return ""
     
-    def mark_order_notified(self, order_code: str):
-        """Отметить заказ как обработанный"""
+    async def _get_warehouse_info(self, entry_id: str) -> Dict:
+        """
+        Склад отправки позиции заказа
+        
+        Args:
+            entry_id: ID позиции заказа
+        
+        Returns:
+            Словарь с id, name и address склада (заглушки, если склад недоступен)
+        """
         try:
-            self.db.mark_as_notified(order_code)
-            logger.info(f"Заказ {order_code} отмечен как обработанный")
+            async with self._kaspi_limit:
+                warehouse_response = await self.kaspi.get_delivery_point(entry_id)
+            warehouse_data = warehouse_response.get('data', {})
+            warehouse_attrs = warehouse_data.get('attributes', {})
+            return {
+                'id': warehouse_data.get('id', ''),
+                'name': warehouse_attrs.get('displayName', 'Не указан'),
+                'address': warehouse_attrs.get('address', {}).get('formattedAddress', 'Адрес не указан')
+            }
         except Exception as e:
-            logger.error(f"Ошибка при отметке заказа как обработанного: {e}")
+            logger.warning("Не удалось получить информацию о складе: %s", e)
+            return {
+                'id': '',
+                'name': 'Не указан',
+                'address': 'Адрес не указан'
+            }
+    
+    @staticmethod
+    def _order_data(order_info: Dict) -> Dict:
+        """Данные заказа для записи в БД из полной информации о заказе"""
+        order_data = {field: order_info[field] for field in ORDER_DB_FIELDS}
+        for field, default in ORDER_DB_OPTIONAL_FIELDS.items():
+            order_data[field] = order_info.get(field, default)
+        return order_data
+    
+    def save_orders_to_db(self, orders: List[Dict]):
+        """
+        Сохранить пачку заказов в БД и отметить их как обработанные
+        
+        Синхронный метод - из async кода вызывается через asyncio.to_thread
+        
+        Args:
+            orders: Список словарей с полной информацией о заказах
+        
+        Raises:
+            Exception: Если сохранить не удалось - тогда заказы не отмечаются
+                как обработанные и уведомления о них не отправляются
+        """
+        self.db.save_orders_bulk([self._order_data(order_info) for order_info in orders])
+        self._notified.update(order_info['code'] for order_info in orders)
+        logger.info("Сохранено и отмечено как обработанные заказов: %s", len(orders))
     
     async def get_active_orders(self) -> List[Dict]:
         """
@@ -340,32 +556,52 @@ class OrderService:
             Список заказов из базы данных
         """
         try:
-            orders = self.db.get_active_orders()
+            orders = await asyncio.to_thread(self.db.get_active_orders)
             return [
                 {
                     'id': order.id,
                     'code': order.code,
                     'status': order.status,
-                    'state': order.state,
                     'customer_name': order.customer_name,
-                    'customer_phone': order.customer_phone,
                     'total_price': order.total_price,
                     'warehouse_name': order.warehouse_name,
-                    'warehouse_address': order.warehouse_address,
                     'delivery_address': order.delivery_address,
                     'planned_delivery_date': order.planned_delivery_date,
                     'creation_date': order.created_at,
                     'is_kaspi_delivery': order.is_kaspi_delivery,
-                    'is_express': getattr(order, 'is_express', False),
+                    'delivery_mode': order.delivery_mode,
+                    'delivery_type_text': self._get_delivery_type_text(
+                        order.delivery_mode or '',
+                        bool(order.is_kaspi_delivery)
+                    ),
+                    'is_express': order.is_express,
                     'waybill_url': order.waybill_url,
-                    'items': order.items 
+                    'items': self._with_code_short(order.items)
                 }
                 for order in orders
             ]
         except Exception as e:
-            logger.error(f"Ошибка при получении активных заказов: {e}")
+            logger.error("Ошибка при получении активных заказов: %s", e)
             return []
     
+    @staticmethod
+    def _with_code_short(items: List[Dict]) -> List[Dict]:
+        """
+        Добавить товарам code_short - код из description (часть после последнего |)
+        
+        Разбор выполняется один раз при загрузке заказа, а не при каждом выводе списка
+        
+        Args:
+            items: Товары заказа
+        
+        Returns:
+            Те же товары с заполненным code_short
+        """
+        for item in items:
+            description = item.get('description')
+            item['code_short'] = description.rpartition('|')[2].strip() if description else ''
+        return items
+    
     async def accept_order(self, order_id: str, order_code: str) -> bool:
         """
         Принять заказ через API
@@ -381,75 +617,87 @@ class OrderService:
             result = await self.kaspi.accept_order(order_id, order_code)
             
             # Обновляем статус в БД
-            self.db.update_order_status(order_code, 'ACCEPTED_BY_MERCHANT')
+            await asyncio.to_thread(self.db.update_order_status, order_code, 'ACCEPTED_BY_MERCHANT')
+            self._status_cache.pop(order_code, None)
             
-            logger.info(f"✅ Заказ {order_code} успешно принят")
+            logger.info("✅ Заказ %s успешно принят", order_code)
             return True
             
         except Exception as e:
-            logger.error(f"❌ Ошибка при принятии заказа {order_code}: {e}")
+            logger.error("❌ Ошибка при принятии заказа %s: %s", order_code, e)
             return False
     
-    async def create_waybill(self, order_id: str, number_of_spaces: int = 1) -> Dict:
+    async def create_waybill(self, order_id: str, number_of_spaces: int = 1,
+                             order_code: Optional[str] = None) -> Dict:
         """
         Сформировать накладную для заказа (изменить статус на ASSEMBLE)
         
+        Одновременные вызовы для одного заказа (повторное нажатие кнопки)
+        ждут одно формирование
+        
+        Args:
+            order_id: ID заказа
+            number_of_spaces: Количество мест в заказе
+            order_code: Код заказа, если известен (иначе извлекается из order_id)
+        
+        Returns:
+            Словарь с результатом (waybill_url если есть) или False при ошибке
+        """
+        return await self._singleflight(
+            ('waybill', order_id), lambda: self._create_waybill(order_id, number_of_spaces, order_code)
+        )
+    
+    async def _create_waybill(self, order_id: str, number_of_spaces: int, order_code: Optional[str]) -> Dict:
+        """
+        Сформировать накладную (без объединения одновременных вызовов)
+        
         Args:
             order_id: ID заказа
             number_of_spaces: Количество мест в заказе
+            order_code: Код заказа или None
         
         Returns:
             Словарь с результатом (waybill_url если есть) или False при ошибке
         """
         try:
             # Шаг 1: Изменяем статус на ASSEMBLE
-            import base64
-            order_code = base64.b64decode(order_id).decode('utf-8')
-
+            # (ID заказа Kaspi - код заказа в base64, декодируем только если код не передан)
+            if order_code is None:
+                order_code = base64.b64decode(order_id).decode('utf-8')
+            
             result = await self.kaspi.change_order_status(
                 order_code=order_code,  
                 status='ASSEMBLE',
                 number_of_space=number_of_spaces
             )
             
-            logger.info(f"Статус заказа {order_id} изменен на ASSEMBLE")
+            logger.info("Статус заказа %s изменен на ASSEMBLE", order_id)
             
             # Шаг 2: Получаем информацию о заказе для получения URL накладной
             # Kaspi API не возвращает waybill сразу, нужно запросить заказ отдельно
-            import asyncio
-            await asyncio.sleep(2)  # Даем время Kaspi сгенерировать накладную
+            attributes = await self._poll_waybill(order_id)
             
-            order_info = await self.kaspi.get_order_by_id(order_id)
-            attributes = order_info.get('data', {}).get('attributes', {})
-            
-            # Получаем код заказа
-            order_code = attributes.get('code')
+            # Получаем код заказа (если опрос не удался - известный код)
+            order_code = attributes.get('code') or order_code
             
             # Получаем URL накладной
             waybill_url = attributes.get('waybill')
             
-            # Если URL накладной еще не готов, пробуем еще раз через 3 секунды
-            if not waybill_url:
-                logger.info(f"Накладная еще не готова, ожидаю 3 секунды...")
-                await asyncio.sleep(3)
-                order_info = await self.kaspi.get_order_by_id(order_id)
-                attributes = order_info.get('data', {}).get('attributes', {})
-                waybill_url = attributes.get('waybill')
-            
             # Скачиваем PDF накладной если есть URL
             waybill_pdf_data = None
             if waybill_url:
-                logger.info(f"Скачиваю PDF накладной по URL: {waybill_url}")
+                logger.info("Скачиваю PDF накладной по URL: %s", waybill_url)
                 waybill_pdf_data = await self._download_waybill_pdf(waybill_url)
             
             # Обновляем статус и URL накладной в БД
             if order_code:
-                self.db.update_order_status(order_code, 'ASSEMBLE')
+                await asyncio.to_thread(self.db.update_order_status, order_code, 'ASSEMBLE')
+                self._status_cache.pop(order_code, None)
                 if waybill_url:
-                    self.db.update_order_waybill(order_code, waybill_url, waybill_pdf_data)
-                    logger.info(f"✅ Накладная для заказа {order_code} сформирована и сохранена")
+                    await asyncio.to_thread(self.db.update_order_waybill, order_code, waybill_url, waybill_pdf_data)
+                    logger.info("✅ Накладная для заказа %s сформирована и сохранена", order_code)
                 else:
-                    logger.warning(f"⚠️ Накладная для заказа {order_code} сформирована, но URL еще не доступен")
+                    logger.warning("⚠️ Накладная для заказа %s сформирована, но URL еще не доступен", order_code)
             
             return {
                 'success': True,
@@ -457,17 +705,89 @@ class OrderService:
             }
             
         except Exception as e:
-            logger.error(f"❌ Ошибка при формировании накладной для заказа {order_id}: {e}")
+            logger.error("❌ Ошибка при формировании накладной для заказа %s: %s", order_id, e)
             return False
     
+    async def _poll_waybill(self, order_id: str) -> Dict:
+        """
+        Дождаться, пока Kaspi сгенерирует накладную
+        
+        Заказ перезапрашивается с растущими паузами (см. WAYBILL_POLL_DELAY),
+        пока в нем не появится URL накладной или не истечет WAYBILL_POLL_TIMEOUT.
+        Неудачный запрос не повторяется - ждем следующего опроса
+        
+        Args:
+            order_id: ID заказа
+        
+        Returns:
+            Атрибуты заказа из последнего успешного ответа (waybill может отсутствовать,
+            пустой словарь - если ни один запрос не удался)
+        """
+        deadline = time.monotonic() + WAYBILL_POLL_TIMEOUT
+        delay = WAYBILL_POLL_DELAY
+        attributes = {}
+        
+        while True:
+            try:
+                order_info = await asyncio.wait_for(
+                    self.kaspi.get_order_by_id(order_id, retry=False),
+                    max(deadline - time.monotonic(), 0.0)
+                )
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                logger.warning("Не удалось проверить накладную заказа %s: %s", order_id, type(e).__name__)
+            else:
+                attributes = order_info.get('data', {}).get('attributes', {})
+                if attributes.get('waybill'):
+                    return attributes
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return attributes
+            
+            logger.info("Накладная еще не готова, ожидаю %.1f с...", min(delay, remaining))
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, WAYBILL_POLL_MAX_DELAY)
+    
     async def check_order_status(self, order_id: str, order_code: str) -> Dict:
         """
         Проверить текущий статус заказа
         
+        Результат переиспользуется ORDER_STATUS_CACHE_TTL секунд, одновременные вызовы
+        для одного заказа ждут один запрос к Kaspi. Ошибки не кэшируются.
+        
         Args:
             order_id: ID заказа
             order_code: Код заказа
         
+        Returns:
+            Словарь с информацией о статусе заказа или None при ошибке
+            (общий для вызывающих - не изменять)
+        """
+        cached = self._status_cache.get(order_code)
+        if cached is not None and time.monotonic() - cached[0] < ORDER_STATUS_CACHE_TTL:
+            return cached[1]
+        
+        status = await self._singleflight(
+            ('status', order_code), lambda: self._fetch_order_status(order_code)
+        )
+        
+        if status is not None:
+            # Заодно убираем устаревшие записи - кэш не растет
+            now = time.monotonic()
+            self._status_cache = {
+                code: entry for code, entry in self._status_cache.items()
+                if now - entry[0] < ORDER_STATUS_CACHE_TTL
+            }
+            self._status_cache[order_code] = (now, status)
+        return status
+    
+    async def _fetch_order_status(self, order_code: str) -> Optional[Dict]:
+        """
+        Запросить статус заказа у Kaspi (без кэша)
+        
+        Args:
+            order_code: Код заказа
+        
         Returns:
             Словарь с информацией о статусе заказа или None при ошибке
         """
@@ -477,7 +797,7 @@ class OrderService:
             orders = response.get('data', [])
             
             if not orders:
-                logger.warning(f"Заказ {order_code} не найден")
+                logger.warning("Заказ %s не найден", order_code)
                 return None
             
             order = orders[0]
@@ -490,10 +810,10 @@ class OrderService:
                 waybill_url = kaspi_delivery.get('waybill')
             
             # Скачиваем PDF если есть URL и его еще нет в БД
-            if waybill_url and not self.db.get_order_waybill_pdf(order_code):
+            if waybill_url and not await asyncio.to_thread(self.db.has_order_waybill_pdf, order_code):
                 waybill_pdf_data = await self._download_waybill_pdf(waybill_url)
                 if waybill_pdf_data:
-                    self.db.update_order_waybill(order_code, waybill_url, waybill_pdf_data)
+                    await asyncio.to_thread(self.db.update_order_waybill, order_code, waybill_url, waybill_pdf_data)
             
             return {
                 'status': attributes.get('status'),
@@ -503,7 +823,7 @@ class OrderService:
             }
             
         except Exception as e:
-            logger.error(f"❌ Ошибка при проверке статуса заказа {order_code}: {e}")
+            logger.error("❌ Ошибка при проверке статуса заказа %s: %s", order_code, e)
             return None
     
     def clear_database(self) -> int:
@@ -513,4 +833,6 @@ class OrderService:
         Returns:
             Количество удаленных записей
         """
-        return self.db.clear_all_orders()
\ No newline at end of file
+        deleted = self.db.clear_all_orders()
+        self._notified.clear()
+        return deleted
\ No newline at end of file
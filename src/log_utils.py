@@ -0,0 +1,38 @@
+"""
+Вспомогательные классы для логирования
+"""
+import logging
+import time
+from typing import Dict
+
+
+class ErrorOnceLogger:
+    """
+    Логирование ошибок с трассировкой стека только при первом появлении
+
+    Трассировка для каждого типа исключения пишется не чаще раза в interval секунд,
+    в остальное время - одна короткая строка без стека
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = 3600.0):
+        self.logger = logger
+        self.interval = interval
+        self._last_traceback: Dict[type, float] = {}
+
+    def error(self, message: str, exc: BaseException):
+        """
+        Залогировать ошибку
+
+        Args:
+            message: Описание того, что не удалось сделать
+            exc: Пойманное исключение
+        """
+        exc_type = type(exc)
+        now = time.monotonic()
+        last = self._last_traceback.get(exc_type)
+
+        if last is None or now - last > self.interval:
+            self._last_traceback[exc_type] = now
+            self.logger.error("%s: %s: %s", message, exc_type.__name__, exc, exc_info=exc)
+        else:
+            self.logger.error("%s: %s: %s", message, exc_type.__name__, exc)